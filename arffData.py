@@ -0,0 +1,104 @@
+# arffData.py
+# -----------
+# Minimal reader for the ARFF files written by Game.run and by Weka.  It
+# only understands what those files use: numeric and nominal attributes,
+# dense data rows and '?' for missing values.
+
+import re
+
+class ArffAttribute:
+    """
+    One @ATTRIBUTE declaration.  values is None for numeric attributes and the
+    list of allowed labels for nominal ones.
+    """
+
+    def __init__(self, name, values=None):
+        self.name = name
+        self.values = values
+
+    def isNominal(self):
+        return self.values is not None
+
+    def indexOf(self, value):
+        "Returns the position of a nominal label, or -1 if it is not declared."
+        if value in self.values:
+            return self.values.index(value)
+        return -1
+
+    def __str__(self):
+        if self.isNominal():
+            return "@ATTRIBUTE %s {%s}" % (self.name, ", ".join(self.values))
+        return "@ATTRIBUTE %s NUMERIC" % self.name
+
+_attributeLine = re.compile(r"@attribute\s+('[^']*'|\"[^\"]*\"|\S+)\s+(.*)$", re.IGNORECASE)
+
+def unquote(value):
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
+
+def parseAttribute(line):
+    match = _attributeLine.match(line.strip())
+    if match is None:
+        raise Exception("Malformed attribute declaration: " + line)
+    name, kind = unquote(match.group(1)), match.group(2).strip()
+    if kind.startswith("{"):
+        return ArffAttribute(name, [unquote(v) for v in kind.strip("{}").split(",")])
+    return ArffAttribute(name)
+
+def parseHeader(lines):
+    "Returns (relation, attributes) declared by the header lines of an ARFF file."
+    relation = None
+    attributes = []
+    for line in lines:
+        lower = line.strip().lower()
+        if lower.startswith("@relation"):
+            relation = unquote(line.strip()[len("@relation"):])
+        elif lower.startswith("@attribute"):
+            attributes.append(parseAttribute(line))
+        elif lower.startswith("@data"):
+            break
+    return relation, attributes
+
+def readHeader(fileName):
+    "Returns the list of ArffAttributes declared in an ARFF file."
+    f = open(fileName)
+    try:
+        return parseHeader(f)[1]
+    finally:
+        f.close()
+
+def parseValue(attribute, value):
+    value = unquote(value)
+    if value == "?":
+        return None
+    if attribute.isNominal():
+        return value
+    return float(value)
+
+def readArff(fileName):
+    """
+    Returns (attributes, rows) where each row is a list with one value per
+    attribute: floats for numeric attributes, labels for nominal ones and
+    None for missing values.
+    """
+    attributes = []
+    rows = []
+    inData = False
+    f = open(fileName)
+    try:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("%"):
+                continue
+            if inData:
+                values = line.split(",")
+                rows.append([parseValue(a, v) for a, v in zip(attributes, values)])
+            elif line.lower().startswith("@attribute"):
+                attributes.append(parseAttribute(line))
+            elif line.lower().startswith("@data"):
+                inData = True
+    finally:
+        f.close()
+    return attributes, rows
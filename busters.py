@@ -28,6 +28,12 @@ from game import Configuration
 from util import nearestPoint
 from util import manhattanDistance
 import sys, util, types, time, random, layout, os
+import bisect
+import numpy
+import datasetWriter
+import distanceCalculator
+import trajectoryLog
+from featureExtractor import LOG_SCHEMA, schemaFor
 
 ########################################
 # Parameters for noisy sensor readings #
@@ -61,6 +67,73 @@ def getObservationDistribution(noisyDistance):
         observationDistributions[noisyDistance] = distribution
     return observationDistributions[noisyDistance]
 
+emissionTables = {}
+def getEmissionTable(maxDistance):
+    """
+    Returns P( noisyDistance | trueDistance ) for true distances up to
+    maxDistance, as a matrix with a row for every noisy distance they can
+    produce and a column per true distance.  Row noisyDistance holds the
+    values of getObservationDistribution(noisyDistance), so it can be indexed
+    with an array of true distances.
+    """
+    if maxDistance not in emissionTables:
+        table = numpy.zeros((maxDistance + SONAR_MAX + 1, maxDistance + 1))
+        for noisyDistance in range(len(table)):
+            for error, prob in zip(SONAR_NOISE_VALUES, SONAR_NOISE_PROBS):
+                trueDistance = max(1, noisyDistance - error)
+                if trueDistance <= maxDistance:
+                    table[noisyDistance, trueDistance] += prob
+        emissionTables[maxDistance] = table
+    return emissionTables[maxDistance]
+
+class FoodIndex:
+    """
+    The food dots left on the board, grouped by column: columns[x] is the
+    sorted list of the y coordinates of the dots in column x.  Indexes are
+    never modified; without() returns a new one that shares every column
+    but the one the eaten dot was in.
+    """
+    def __init__( self, positions=() ):
+        self.columns = {}
+        for x, y in positions:
+            self.columns.setdefault(x, []).append(y)
+        for ys in self.columns.values():
+            ys.sort()
+
+    def without( self, position ):
+        x, y = position
+        index = FoodIndex()
+        index.columns = self.columns.copy()
+        ys = [other for other in self.columns[x] if other != y]
+        if ys:
+            index.columns[x] = ys
+        else:
+            del index.columns[x]
+        return index
+
+    def asList( self ):
+        return [(x, y) for x, ys in self.columns.items() for y in ys]
+
+    def nearest( self, position ):
+        """
+        Manhattan distance from position to the closest dot, None if there
+        are none.  Columns are visited from the closest one outwards and the
+        search stops once no column left can hold a closer dot.
+        """
+        px, py = position
+        best = None
+        for x in sorted(self.columns, key=lambda x: abs(x - px)):
+            dx = abs(x - px)
+            if best is not None and dx >= best:
+                break
+            ys = self.columns[x]
+            i = bisect.bisect_left(ys, py)
+            for y in ys[max(0, i - 1):i + 1]:
+                distance = dx + abs(y - py)
+                if best is None or distance < best:
+                    best = distance
+        return best
+
 ###################################################
 # YOUR INTERFACE TO THE PACMAN WORLD: A GameState #
 ###################################################
@@ -117,7 +190,7 @@ class GameState:
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
         else:
-            GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+            GhostRules.decrementTimer( state.data.mutableAgentState(agentIndex) )
 
         # Resolve multi-agent effects
         GhostRules.checkDeath( state, agentIndex )
@@ -129,7 +202,12 @@ class GameState:
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
         p = state.getPacmanPosition()
-        state.data.ghostDistances = [getNoisyDistance(p, state.getGhostPosition(i)) for i in range(1,state.getNumAgents())]
+        if agentIndex == 0:
+            state.data.ghostDistances = [getNoisyDistance(p, state.getGhostPosition(i)) for i in range(1,state.getNumAgents())]
+        else:
+            # Only the ghost that moved can be somewhere else
+            state.data.ghostDistances = self.data.ghostDistances[:]
+            state.data.ghostDistances[agentIndex - 1] = getNoisyDistance(p, state.getGhostPosition(agentIndex))
         state.ghostPositions = self.ghostPositions = [self.getGhostPosition(i) for i in range(1, self.getNumAgents())]
         a = 0
         for i in range(1, self.getNumAgents()):
@@ -173,7 +251,7 @@ class GameState:
         return self.data.capsules
 
     def getNumFood( self ):
-        return self.data.food.count()
+        return self.numFood
 
     def getFood(self):
         """
@@ -217,24 +295,23 @@ class GameState:
         """
         return self.livingGhosts
 
-    def getDistanceNearestFood(self):
+    def getDistanceNearestFood(self, distancer=None):
         """
-        Returns the distance to the nearest food
+        Returns the distance to the nearest food, None if there is none left.
+
+        The distance is the Manhattan distance unless a Distancer (see
+        distanceCalculator.py) is given, in which case it is the maze
+        distance.
         """
-        if(self.getNumFood() > 0):
-            minDistance = 900000
-            pacmanPosition = self.getPacmanPosition()
-            for i in range(self.data.layout.width):
-                for j in range(self.data.layout.height):
-                    if self.hasFood(i, j):
-                        foodPosition = i, j
-                        distance = util.manhattanDistance(pacmanPosition, foodPosition)
-                        if distance < minDistance:
-                            minDistance = distance
-            return minDistance
+        if self.numFood == 0:
+            return None
+        pacmanPosition = self.getPacmanPosition()
+        if distancer is None:
+            if self.nearestFood is None:
+                self.nearestFood = self.foodIndex.nearest(pacmanPosition)
+            return self.nearestFood
 
-        else:
-            return None;
+        return int(distancer.getDistances(pacmanPosition, self.foodIndex.asList()).min())
 
     def getGhostPositions(self):
         return self.ghostPositions
@@ -243,6 +320,8 @@ class GameState:
         return self.ghostDirections
 
     def setGhostNotLiving(self, index):
+        # The list may be shared with the previous state
+        self.livingGhosts = self.livingGhosts[:]
         self.livingGhosts[index] = False
 
     def isLose( self ):
@@ -265,11 +344,17 @@ class GameState:
     def __init__( self, prevState = None ):
         """
         Generates a new state by copying information from its predecessor.
+
+        Successors share everything they do not change with their predecessor
+        (see GameStateData): the rules copy agent states, the food grid and
+        the lists below before modifying them.
         """
         if prevState != None:
-            self.data = GameStateData(prevState.data)
-            self.livingGhosts = prevState.livingGhosts[:]
-            self.ghostPositions = prevState.ghostPositions[:]
+            self.data = GameStateData(prevState.data, copyOnWrite=True)
+            self.livingGhosts = prevState.livingGhosts
+            self.ghostPositions = prevState.ghostPositions
+            self.numFood = prevState.numFood
+            self.foodIndex = prevState.foodIndex
             self.numMoves = prevState.numMoves;
             self.maxMoves = prevState.maxMoves;
         else: # Initial state
@@ -277,6 +362,24 @@ class GameState:
             self.numMoves = 0;
             self.maxMoves = -1;
             self.data.ghostDistances = []
+        # Manhattan distance to the nearest food, computed when first asked for
+        self.nearestFood = None
+
+    def getObservation( self ):
+        """
+        Returns a copy of this state for an agent to observe, built in
+        constant time.  It shares the layout, the food grid and the agent
+        states with this state, so agents must treat it as read-only; they
+        can still replace its fields (as observationFunction does) and
+        generate successors from it, which copy what they change.
+        """
+        state = GameState( self )
+        state.data._agentMoved = self.data._agentMoved
+        state.data._foodEaten = self.data._foodEaten
+        state.data._foodAdded = self.data._foodAdded
+        state.data._capsuleEaten = self.data._capsuleEaten
+        state.data.ghostDistances = self.data.ghostDistances
+        return state
 
     def deepCopy( self ):
         state = GameState( self )
@@ -305,6 +408,8 @@ class GameState:
         Creates an initial game state from a layout array (see layout.py).
         """
         self.data.initialize(layout, numGhostAgents)
+        self.numFood = self.data.food.count()
+        self.foodIndex = FoodIndex(self.data.food.asList())
         self.livingGhosts = [False] + [True for i in range(numGhostAgents)]
         self.data.ghostDistances = [getNoisyDistance(self.getPacmanPosition(), self.getGhostPosition(i)) for i in range(1, self.getNumAgents())]
         self.ghostPositions = [self.getGhostPosition(i) for i in range(1, self.getNumAgents())]
@@ -338,11 +443,11 @@ class BustersGameRules:
     and how the game starts and ends.
     """
 
-    def newGame( self, layout, pacmanAgent, ghostAgents, display, maxMoves= -1 ):
+    def newGame( self, layout, pacmanAgent, ghostAgents, display, maxMoves= -1, dataWriter=None ):
         agents = [pacmanAgent] + ghostAgents
         initState = GameState()
         initState.initialize( layout, len(ghostAgents))
-        game = Game(agents, display, self)
+        game = Game(agents, display, self, dataWriter=dataWriter)
         game.state = initState
         game.state.maxMoves = maxMoves
         return game
@@ -380,7 +485,7 @@ class PacmanRules:
         if action not in legal:
             raise "Illegal action", action
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.mutableAgentState(0)
 
         # Update Configuration
         vector = Actions.directionToVector( action, 1)
@@ -402,7 +507,7 @@ class GhostRules:
         if action not in legal:
             raise Exception("Illegal ghost action: " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.mutableAgentState(ghostIndex)
         vector = Actions.directionToVector( action, 1 )
         ghostState.configuration = ghostState.configuration.generateSuccessor( vector )
     applyAction = staticmethod( applyAction )
@@ -410,7 +515,9 @@ class GhostRules:
     def decrementTimer( ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint( ghostState.configuration.pos )
+            # Configurations are shared between copies of an agent state
+            conf = ghostState.configuration
+            ghostState.configuration = Configuration( nearestPoint( conf.pos ), conf.direction )
         ghostState.scaredTimer = max( 0, timer - 1 )
     decrementTimer = staticmethod( decrementTimer )
 
@@ -421,12 +528,12 @@ class GhostRules:
                 ghostState = state.data.agentStates[index]
                 ghostPosition = ghostState.configuration.getPosition()
                 if GhostRules.canKill( pacmanPosition, ghostPosition ):
-                    GhostRules.collide( state, ghostState, index )
+                    GhostRules.collide( state, state.data.mutableAgentState(index), index )
         else:
             ghostState = state.data.agentStates[agentIndex]
             ghostPosition = ghostState.configuration.getPosition()
             if GhostRules.canKill( pacmanPosition, ghostPosition ):
-                GhostRules.collide( state, ghostState, agentIndex )
+                GhostRules.collide( state, state.data.mutableAgentState(agentIndex), agentIndex )
     checkDeath = staticmethod( checkDeath )
 
     def checkFoodEaten( state, agentIndex):
@@ -434,7 +541,10 @@ class GhostRules:
         if agentIndex == 0: # Pacman just moved; Anyone can kill him
             if state.hasFood(pacmanPosition[0], pacmanPosition[1]):
                 state.data._foodEaten = pacmanPosition[0], pacmanPosition[1]
+                state.data.food = state.data.food.copy()
                 state.data.food[pacmanPosition[0]][pacmanPosition[1]] = False
+                state.numFood -= 1
+                state.foodIndex = state.foodIndex.without(pacmanPosition)
                 state.data.scoreChange += 100
     checkFoodEaten = staticmethod( checkFoodEaten )
 
@@ -443,6 +553,7 @@ class GhostRules:
         state.data.scoreChange += 200
         GhostRules.placeGhost(ghostState, agentIndex)
         # Added for first-person
+        state.data._eaten = state.data._eaten[:]
         state.data._eaten[agentIndex] = True
         state.setGhostNotLiving(agentIndex)
     collide = staticmethod( collide )
@@ -473,6 +584,9 @@ class RandomGhost:
 # FRAMEWORK TO START A GAME #
 #############################
 
+# Default data file of each --dataFormat
+DATA_FILES = {'arff': 'prueba.arff', 'columns': 'prueba.cols'}
+
 def default(str):
     return str + ' [Default: %default]'
 
@@ -525,6 +639,24 @@ def readCommand( argv ):
                       help='Renders the ghosts in the display (cheating)', default=True)
     parser.add_option('-t', '--frameTime', dest='frameTime', type='float',
                       help=default('Time to delay between frames; <0 means keyboard'), default=0.1)
+    parser.add_option('-d', '--dataFile', dest='dataFile',
+                      help='File the data of logging agents is appended to ("" to disable) '
+                           '[Default: prueba.arff, or the directory prueba.cols with --dataFormat columns]',
+                      metavar='FILE', default=None)
+    parser.add_option('--dataBuffer', dest='dataBuffer', type='int',
+                      help=default('Characters of data kept in memory before writing them'),
+                      default=datasetWriter.BUFFER_SIZE)
+    parser.add_option('--dataFormat', dest='dataFormat', type='choice', choices=['arff', 'columns'],
+                      help=default('Format of the data file: arff, or columns for a directory '
+                                   'with one binary file per attribute (see trajectoryLog.py)'),
+                      default='arff')
+    parser.add_option('--dataTargets', dest='dataTargets',
+                      help=default('Comma separated look ahead columns added to every row: '
+                                   'next_score and/or score_delta_K (score gained in K moves)'),
+                      default='next_score')
+    parser.add_option('--distanceProcesses', dest='distanceProcesses', type='int',
+                      help=default('Processes computing maze distances (0 computes them in the game process)'),
+                      default=0)
 
     options, otherjunk = parser.parse_args()
     if len(otherjunk) != 0:
@@ -555,6 +687,24 @@ def readCommand( argv ):
                                                                   frameTime = options.frameTime)
     args['numGames'] = options.numGames
 
+    if options.distanceProcesses > 0:
+        distanceCalculator.startPool(options.distanceProcesses)
+
+    if options.dataFile is None:
+        options.dataFile = DATA_FILES[options.dataFormat]
+    # The data file is checked now rather than when the first game is flushed
+    if options.dataFile:
+        targets = datasetWriter.parseTargets(options.dataTargets)
+        schema = schemaFor(LOG_SCHEMA.attributes[:-1] + datasetWriter.targetAttributes(targets))
+        if options.dataFormat == 'columns':
+            trajectoryLog.checkTarget(options.dataFile)
+            writer = trajectoryLog.TrajectoryWriter(options.dataFile, schema.attributes)
+        else:
+            datasetWriter.checkHeader(options.dataFile, schema.header('pacman'))
+            writer = datasetWriter.DatasetWriter(options.dataFile, schema.header('pacman'),
+                                                 bufferSize=options.dataBuffer)
+        args['dataWriter'] = datasetWriter.LookAheadLabeller(writer, targets)
+
     return args
 
 def loadAgent(pacman, nographics):
@@ -580,7 +730,7 @@ def loadAgent(pacman, nographics):
                 return getattr(module, pacman)
     raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
-def runGames( layout, pacman, ghosts, display, numGames, maxMoves=-1):
+def runGames( layout, pacman, ghosts, display, numGames, maxMoves=-1, dataWriter=None):
     # Hack for agents writing to the display
     import __main__
     __main__.__dict__['_display'] = display
@@ -589,10 +739,13 @@ def runGames( layout, pacman, ghosts, display, numGames, maxMoves=-1):
     games = []
 
     for i in range( numGames ):
-        game = rules.newGame( layout, pacman, ghosts, display, maxMoves )
+        game = rules.newGame( layout, pacman, ghosts, display, maxMoves, dataWriter )
         game.run()
         games.append(game)
 
+    if dataWriter is not None:
+        dataWriter.close()
+
     if numGames > 1:
         scores = [game.state.getScore() for game in games]
         wins = [game.state.isWin() for game in games]
@@ -18,7 +18,10 @@ from game import Directions
 from keyboardAgents import KeyboardAgent
 import inference
 import busters
+import nativeModels
+from featureExtractor import LOG_SCHEMA, getSchema, schemaFor, formatRow
 import random
+import numpy
 
 class NullGraphics:
     "Placeholder for graphics"
@@ -41,27 +44,23 @@ class KeyboardInference(inference.InferenceModule):
     """
     def initializeUniformly(self, gameState):
         "Begin with a uniform distribution over ghost positions."
-        self.beliefs = util.Counter()
-        for p in self.legalPositions: self.beliefs[p] = 1.0
-        self.beliefs.normalize()
+        self.beliefs = self.space.legal / float(self.space.legal.sum())
 
     def observe(self, observation, gameState):
+        "Uniform over the legal positions the observation does not rule out."
         noisyDistance = observation
-        emissionModel = busters.getObservationDistribution(noisyDistance)
+        if noisyDistance is None:
+            self.beliefs = numpy.zeros(len(self.space.cells))
+            return
         pacmanPosition = gameState.getPacmanPosition()
-        allPossible = util.Counter()
-        for p in self.legalPositions:
-            trueDistance = util.manhattanDistance(p, pacmanPosition)
-            if emissionModel[trueDistance] > 0:
-                allPossible[p] = 1.0
-        allPossible.normalize()
-        self.beliefs = allPossible
+        possible = self.space.legal & (self.space.likelihood(noisyDistance, pacmanPosition) > 0)
+        self.beliefs = possible / float(max(1, possible.sum()))
 
     def elapseTime(self, gameState):
         pass
 
     def getBeliefDistribution(self):
-        return self.beliefs
+        return self.space.toCounter(self.beliefs)
 
 
 class BustersAgent:
@@ -72,9 +71,16 @@ class BustersAgent:
         self.inferenceModules = [inferenceType(a) for a in ghostAgents]
         self.observeEnable = observeEnable
         self.elapseTimeEnable = elapseTimeEnable
+        # The JVM is only started if the agent ever asks Weka for a prediction
         self.weka = Weka()
-        self.weka.start_jvm()
 
+    def final(self, state):
+        "Releases this agent's use of the JVM at the end of each game."
+        self.weka.stop_jvm()
+
+    def getLineData(self, state):
+        "Values of the columns that printLineData logs for this state."
+        return LOG_SCHEMA.extractor().extract(state)
 
     def registerInitialState(self, gameState):
         "Initializes beliefs and inference modules"
@@ -125,78 +131,8 @@ class BustersKeyboardAgent(BustersAgent, KeyboardAgent):
         return (state.getScore())
 
 
-    def printLineData(self, state):  ##################################################################################################################################################
-        pacmanx, pacmany = state.getPacmanPosition()
-
-        legal_actions_bool = ""
-        if "West" in state.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "East" in state.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "North" in state.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "South" in state.getLegalPacmanActions():
-            legal_actions_bool += "1"
-        else:
-            legal_actions_bool += "0"
-
-        aliveG = ""
-        for alive in state.getLivingGhosts():
-            if alive:
-                aliveG = aliveG + str(1) + ", "
-            else:
-                aliveG = aliveG + str(0) + ", "
-        aliveG = aliveG[:-2]
-
-        ghost_dir = ""
-        for direction in [state.getGhostDirections().get(i) for i in range(0, state.getNumAgents() - 1)]:
-            if direction is "West":
-                ghost_dir += "1, 0, 0, 0, 0, "
-            elif direction is "Stop":
-                ghost_dir += "0, 1, 0, 0, 0, "
-            elif direction is "East":
-                ghost_dir += "0, 0, 1, 0, 0, "
-            elif direction is "North":
-                ghost_dir += "0, 0, 0, 1, 0, "
-            elif direction is "South":
-                ghost_dir += "0, 0, 0, 0, 1, "
-        ghost_dir = ghost_dir[:-2]
-
-        ghostdist = ""
-        for dist in state.data.ghostDistances:
-            if dist is None:
-                dist = -1
-            ghostdist = ghostdist + str(dist) + ", "
-        ghostdist = ghostdist[:-2]
-
-        ghostspos = ""
-        for ghost in state.getGhostPositions():
-            ghostx, ghosty = ghost
-            ghostspos = ghostspos + str(ghostx) + ", " + str(ghosty) + ", "
-        ghostspos = ghostspos[:-2]
-
-        s = ", ".join([
-            str(pacmanx),
-            str(pacmany),
-            legal_actions_bool,
-            str(state.getNumAgents() - 1),
-            aliveG,
-            ghostspos,
-            ghost_dir,
-            ghostdist,
-            str(state.getNumFood()),
-            str(state.getDistanceNearestFood()),
-            str(state.getScore()),
-            str(state.data.agentStates[0].getDirection())
-        ])
-
-        return s
+    def printLineData(self, state):
+        return formatRow(self.getLineData(state))
 
 
 
@@ -375,6 +311,41 @@ def closest_ghost(gameState):
 
 
 class BasicAgentAA(BustersAgent):
+    """
+    Chooses its moves with a classifier trained in Weka.
+
+    backend selects how the model is evaluated: 'weka' runs the serialized
+    model through the JVM, any other name from nativeModels.BACKENDS evaluates
+    an exported copy of it without the JVM.  KStar models cannot be exported
+    and only run with backend=weka.  Example:
+
+      python busters.py -p BasicAgentAA -a backend=j48,model=j48_noghostkeyboard_cv.npz
+      python busters.py -p BasicAgentAA -a backend=ibk,model=ibk1_noghosttutorial1_cv.npz
+      python busters.py -p BasicAgentAA -a backend=rf,model=rf_attselkeyboard_cv.npz
+      python busters.py -p BasicAgentAA -a backend=smo,model=smo_noghostkeyboard_cv.npz
+    """
+
+    def __init__( self, index = 0, inference = "ExactInference", ghostAgents = None,
+                  model = "./ibk1_noghosttutorial1_cv.model",
+                  arffName = "./training_tutorial1_present_noghostdir.arff",
+                  backend = "weka" ):
+        BustersAgent.__init__(self, index, inference, ghostAgents)
+        self.model = model
+        self.arffName = arffName
+        self.predictor = None
+        if backend != "weka":
+            self.predictor = nativeModels.loadPredictor(backend, model, arffName)
+        # The columns the model was trained on, compiled once per header
+        if self.predictor is None:
+            self.features = getSchema(arffName).extractor()
+        else:
+            self.features = schemaFor(self.predictor.attributes).extractor()
+
+    def predict(self, x):
+        "Returns the move that the model predicts for the attribute values x."
+        if self.predictor is None:
+            return self.weka.predict(self.model, x, self.arffName)
+        return self.predictor.predict(x)
 
     def registerInitialState(self, gameState):
         BustersAgent.registerInitialState(self, gameState)
@@ -451,203 +422,20 @@ class BasicAgentAA(BustersAgent):
 
 
 
-        pacmanx, pacmany = gameState.getPacmanPosition()
+        x = self.features.extract(gameState)
 
-        legal_actions_bool = ""
-        if "West" in gameState.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "East" in gameState.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "North" in gameState.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "South" in gameState.getLegalPacmanActions():
-            legal_actions_bool += "1"
-        else:
-            legal_actions_bool += "0"
-        legal = [int(i) for i in legal_actions_bool.split(",")]
+        next_move = self.predict(x)
 
-        aliveG = ""
-        for alive in gameState.getLivingGhosts():
-            if alive:
-                aliveG = aliveG + str(1) + ", "
-            else:
-                aliveG = aliveG + str(0) + ", "
-        aliveG = aliveG[:-2]
-        aliveghost = [int(i) for i in aliveG.split(",")]
-
-
-        ghostspos = ""
-        for ghost in gameState.getGhostPositions():
-            ghostx, ghosty = ghost
-            ghostspos = ghostspos + str(ghostx) + ", " + str(ghosty) + ", "
-        ghostspos = ghostspos[:-2]
-        ghostpositions = [int(i) for i in ghostspos.split(",")]
-
-        ghost_dir = ""
-        for direction in [gameState.getGhostDirections().get(i) for i in range(0, gameState.getNumAgents() - 1)]:
-            if direction is "West":
-                ghost_dir += "1, 0, 0, 0, 0, "
-            elif direction is "Stop":
-                ghost_dir += "0, 1, 0, 0, 0, "
-            elif direction is "East":
-                ghost_dir += "0, 0, 1, 0, 0, "
-            elif direction is "North":
-                ghost_dir += "0, 0, 0, 1, 0, "
-            elif direction is "South":
-                ghost_dir += "0, 0, 0, 0, 1, "
-            elif direction is None:
-                ghost_dir += "0, 1, 0, 0, 0, "
-
-        ghost_dir = ghost_dir[:-2]
-        ghostdirections = [int(i) for i in ghost_dir.split(",")]
-
-
-        ghostdist = ""
-        for dist in gameState.data.ghostDistances:
-            if dist is None:
-                dist = -1
-            ghostdist = ghostdist + str(dist) + ", "
-        ghostdist = ghostdist[:-2]
-        ghostdistances = [int(i) for i in ghostdist.split(",")]
-
-        x = [pacmanx,
-             pacmany,
-             legal[0],
-             legal[1],
-             legal[2],
-             legal[3],
-             gameState.getNumAgents() - 1,
-             aliveghost[0],
-             aliveghost[1],
-             aliveghost[2],
-             aliveghost[3],
-             aliveghost[4],
-             ghostpositions[0],
-             ghostpositions[1],
-             ghostpositions[2],
-             ghostpositions[3],
-             ghostpositions[4],
-             ghostpositions[5],
-             ghostpositions[6],
-             ghostpositions[7],
-             # ghostdirections[0],
-             # ghostdirections[1],
-             # ghostdirections[2],
-             # ghostdirections[3],
-             # ghostdirections[4],
-             # ghostdirections[5],
-             # ghostdirections[6],
-             # ghostdirections[7],
-             # ghostdirections[8],
-             # ghostdirections[9],
-             # ghostdirections[10],
-             # ghostdirections[11],
-             # ghostdirections[12],
-             # ghostdirections[13],
-             # ghostdirections[14],
-             # ghostdirections[15],
-             # ghostdirections[16],
-             # ghostdirections[17],
-             # ghostdirections[18],
-             # ghostdirections[19],
-             ghostdistances[0],
-             ghostdistances[1],
-             ghostdistances[2],
-             ghostdistances[3],
-             int(gameState.getNumFood() or 0),
-             int(gameState.getDistanceNearestFood() or 0),
-             int(gameState.getScore() or 0),
-             gameState.data.agentStates[0].getDirection()]
-
-
-        next_move = self.weka.predict("./ibk1_noghosttutorial1_cv.model", x, "./training_tutorial1_present_noghostdir.arff")
-
-        if next_move in gameState.getLegalActions():
+        if next_move in legal:
             return next_move
         else:
             print "random move"
-            return random.choice(gameState.getLegalActions())
+            return random.choice(legal)
 
 
     def scorefun(self,state):
         return (state.getScore())
 
 
-    def printLineData(self, state):  ##################################################################################################################################################
-        pacmanx, pacmany = state.getPacmanPosition()
-
-        legal_actions_bool = ""
-        if "West" in state.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "East" in state.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "North" in state.getLegalPacmanActions():
-            legal_actions_bool += "1, "
-        else:
-            legal_actions_bool += "0, "
-        if "South" in state.getLegalPacmanActions():
-            legal_actions_bool += "1"
-        else:
-            legal_actions_bool += "0"
-
-        aliveG = ""
-        for alive in state.getLivingGhosts():
-            if alive:
-                aliveG = aliveG + str(1) + ", "
-            else:
-                aliveG = aliveG + str(0) + ", "
-        aliveG = aliveG[:-2]
-
-        ghost_dir = ""
-        for direction in [state.getGhostDirections().get(i) for i in range(0, state.getNumAgents() - 1)]:
-            if direction is "West":
-                ghost_dir += "1, 0, 0, 0, 0, "
-            elif direction is "Stop":
-                ghost_dir += "0, 1, 0, 0, 0, "
-            elif direction is "East":
-                ghost_dir += "0, 0, 1, 0, 0, "
-            elif direction is "North":
-                ghost_dir += "0, 0, 0, 1, 0, "
-            elif direction is "South":
-                ghost_dir += "0, 0, 0, 0, 1, "
-        ghost_dir = ghost_dir[:-2]
-
-        ghostdist = ""
-        for dist in state.data.ghostDistances:
-            if dist is None:
-                dist = -1
-            ghostdist = ghostdist + str(dist) + ", "
-        ghostdist = ghostdist[:-2]
-
-        ghostspos = ""
-        for ghost in state.getGhostPositions():
-            ghostx, ghosty = ghost
-            ghostspos = ghostspos + str(ghostx) + ", " + str(ghosty) + ", "
-        ghostspos = ghostspos[:-2]
-
-        s = ", ".join([
-            str(pacmanx),
-            str(pacmany),
-            legal_actions_bool,
-            str(state.getNumAgents() - 1),
-            aliveG,
-            ghostspos,
-            ghost_dir,
-            ghostdist,
-            str(state.getNumFood()),
-            str(state.getDistanceNearestFood()),
-            str(state.getScore()),
-            str(state.data.agentStates[0].getDirection())
-        ])
-
-        return s
\ No newline at end of file
+    def printLineData(self, state):
+        return formatRow(self.getLineData(state))
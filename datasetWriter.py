@@ -0,0 +1,197 @@
+# datasetWriter.py
+# ----------------
+# Buffered writer for the ARFF training logs captured while playing.  The
+# game hands it one data line per tick; lines are kept in memory and only
+# reach the disk when the buffer grows past bufferSize characters, when
+# flushInterval seconds have passed since the last write, or when flush()
+# is called (Game.run does at the end of every game).
+#
+# The rows reach the writer through a LookAheadLabeller, which completes
+# them with targets that depend on the following ticks (next_score...).
+
+import os
+import re
+import time
+from collections import deque
+
+from arffData import ArffAttribute, parseHeader
+from featureExtractor import formatRow
+
+BUFFER_SIZE = 64 * 1024
+FLUSH_INTERVAL = 5.0
+
+# next_score of the last line of every game
+NO_NEXT_SCORE = 99999999
+
+def endsWithNewline(fileName):
+    f = open(fileName, "rb")
+    try:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == "\n"
+    finally:
+        f.close()
+
+def checkHeader(fileName, header):
+    """
+    Raises if fileName already holds data declared by a header other than
+    header, since appending rows with other columns would corrupt it.
+    """
+    if not os.path.exists(fileName) or os.path.getsize(fileName) == 0:
+        return
+    f = open(fileName)
+    try:
+        relation, attributes = parseHeader(f)
+    finally:
+        f.close()
+    expected, expectedAttributes = parseHeader(header.splitlines())
+    if relation != expected or [str(a) for a in attributes] != [str(a) for a in expectedAttributes]:
+        raise Exception("The ARFF file %s has a different header" % fileName)
+
+class DatasetWriter:
+    """
+    Appends data lines to an ARFF file, writing header first if the file
+    does not exist yet (or is empty).  If it exists, its header must be the
+    same.  The file is opened on the first flush and stays open until
+    close(), so runs where no agent logs anything do not create it.
+    """
+
+    # Whole formatted lines can be written as a single value
+    takesLines = True
+
+    def __init__(self, fileName, header, bufferSize=BUFFER_SIZE, flushInterval=FLUSH_INTERVAL):
+        self.fileName = fileName
+        self.header = header
+        self.bufferSize = bufferSize
+        self.flushInterval = flushInterval
+        self.file = None
+        self.buffer = []
+        self.buffered = 0
+        self.lastFlush = time.time()
+
+    def open(self):
+        if self.file is None:
+            checkHeader(self.fileName, self.header)
+            isNew = not os.path.exists(self.fileName) or os.path.getsize(self.fileName) == 0
+            # Older logs do not end their last row with a newline
+            unterminated = not isNew and not endsWithNewline(self.fileName)
+            self.file = open(self.fileName, "a")
+            if isNew:
+                self.file.write(self.header)
+            elif unterminated:
+                self.file.write("\n")
+
+    def writeLine(self, line):
+        self.buffer.append(line)
+        self.buffer.append("\n")
+        self.buffered += len(line) + 1
+        if self.buffered >= self.bufferSize or time.time() - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+    def writeRow(self, values):
+        "Writes one data line with the given attribute values."
+        self.writeLine(formatRow(values))
+
+    def flush(self):
+        if self.buffer:
+            self.open()
+            self.file.write("".join(self.buffer))
+            self.file.flush()
+            self.buffer = []
+            self.buffered = 0
+        self.lastFlush = time.time()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class NextScore:
+    "Score after the following move, NO_NEXT_SCORE for the last move of a game."
+    name = "next_score"
+    lookAhead = 1
+
+    def label(self, scores):
+        if len(scores) > 1:
+            return scores[1]
+        return NO_NEXT_SCORE
+
+class ScoreDelta:
+    """
+    Score gained over the following steps moves.  Near the end of a game
+    the score stays as the game ended.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.name = "score_delta_%d" % steps
+        self.lookAhead = steps
+
+    def label(self, scores):
+        return scores[min(self.steps, len(scores) - 1)] - scores[0]
+
+def parseTargets(spec):
+    "Targets for a comma separated list such as 'next_score,score_delta_10'."
+    targets = []
+    for name in spec.split(","):
+        name = name.strip()
+        match = re.match(r"score_delta_(\d+)$", name)
+        if name == NextScore.name:
+            targets.append(NextScore())
+        elif match and int(match.group(1)) > 0:
+            targets.append(ScoreDelta(int(match.group(1))))
+        else:
+            raise Exception("Unknown target " + name)
+    return targets
+
+def targetAttributes(targets):
+    return [ArffAttribute(target.name) for target in targets]
+
+class LookAheadLabeller:
+    """
+    Completes the rows of a game with targets computed from the scores of
+    the ticks that follow them, then passes them on to writer (a
+    DatasetWriter or a trajectoryLog.TrajectoryWriter).
+
+    The last rows are kept in a ring buffer as long as the furthest look
+    ahead of the targets; a row is written as soon as it falls out of the
+    window, and endGame() writes the ones still waiting.
+    """
+
+    def __init__(self, writer, targets=None):
+        if targets is None:
+            targets = [NextScore()]
+        self.writer = writer
+        self.targets = targets
+        window = max([target.lookAhead for target in targets]) + 1
+        self.rows = deque(maxlen=window)
+        self.scores = deque(maxlen=window)
+
+    def addRow(self, values, score):
+        "Adds the row of a tick and the score of the state it describes."
+        if len(self.rows) == self.rows.maxlen:
+            self.emit()
+        self.rows.append(values)
+        self.scores.append(score)
+
+    def emit(self):
+        scores = list(self.scores)
+        labels = [target.label(scores) for target in self.targets]
+        self.writer.writeRow(self.rows.popleft() + labels)
+        self.scores.popleft()
+
+    def takesLines(self):
+        "Tells whether the writer accepts an agent's whole printLineData line as one value."
+        return self.writer.takesLines
+
+    def endGame(self):
+        while self.rows:
+            self.emit()
+        self.writer.flush()
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.endGame()
+        self.writer.close()
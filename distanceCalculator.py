@@ -31,6 +31,10 @@ distances.
 """
 
 import threading, sys, time, random
+import hashlib, os, tempfile
+import atexit, multiprocessing
+import numpy
+import layout as layouts
 
 class Distancer:
   def __init__(self, layout, background=True, default=10000):
@@ -44,6 +48,7 @@ class Distancer:
     """
     self._distances = None
     self.default = default
+    self.layout = layout
 
     # Start computing distances in the background; when the dc finishes,
     # it will fill in self._distances for us.
@@ -59,8 +64,11 @@ class Distancer:
     """
     The getDistance function is the only one you'll need after you create the object.
     """
-    if self._distances == None:
+    if self._distances is None:
       return manhattanDistance(pos1, pos2)
+    ids = self._distances.cellIds
+    if pos1 in ids and pos2 in ids:
+      return self._distances.get(ids[pos1], ids[pos2])
     if isInt(pos1) and isInt(pos2):
       return self.getDistanceOnGrid(pos1, pos2)
     pos1Grids = getGrids2D(pos1)
@@ -75,14 +83,47 @@ class Distancer:
     return bestDistance
 
   def getDistanceOnGrid(self, pos1, pos2):
-    key = (pos1, pos2)
-    if key in self._distances:
-      return self._distances[key]
+    ids = self._distances.cellIds
+    if pos1 in ids and pos2 in ids:
+      return self._distances.get(ids[pos1], ids[pos2])
     else:
-      raise Exception("Positions not in grid: " + str(key))
+      raise Exception("Positions not in grid: " + str((pos1, pos2)))
+
+  def distanceRow(self, pos):
+    """
+    Distances from pos to every free cell, as a numpy array indexed by the
+    cell ids of Layout.getCellIds().  Cells that can't be reached from pos
+    hold UNREACHABLE.  The row may be a view of the shared matrix, so it
+    must not be modified.  Until the maze distances are ready the row holds
+    Manhattan distances.
+    """
+    if self._distances is None:
+      cells = numpy.array(self.layout.getFreeCells())
+      return numpy.abs(cells - pos).sum(axis=1)
+    ids = self._distances.cellIds
+    if pos not in ids:
+      raise Exception("Position not in grid: " + str(pos))
+    return self._distances.matrix[ids[pos]]
+
+  def getDistances(self, pos, positions):
+    """
+    Distances from pos to each of positions, as a numpy array.  Positions
+    on free cells are looked up in one go (UNREACHABLE where there is no
+    path, as in distanceRow); fractional ones go through getDistance.
+    """
+    if self._distances is not None:
+      ids = self._distances.cellIds
+      if pos in ids:
+        try:
+          columns = [ids[other] for other in positions]
+        except KeyError:
+          pass
+        else:
+          return self._distances.matrix[ids[pos]][columns]
+    return numpy.array([self.getDistance(pos, other) for other in positions])
 
   def isReadyForMazeDistance(self):
-    return self._distances != None
+    return self._distances is not None
 
 def manhattanDistance(x, y ):
   return abs( x[0] - y[0] ) + abs( x[1] - y[1] )
@@ -108,15 +149,57 @@ def getGrids1D(x):
 # MACHINERY FOR COMPUTING MAZE DISTANCES #
 ##########################################
 
+# Distances of every wall grid seen, as DistanceFutures.  The lock only
+# guards the dictionary: the distances are computed outside of it, so
+# layouts are computed in parallel and Distancers of a layout that is being
+# computed wait for the same result.
 distanceMap = {}
-distanceMapSemaphore = threading.Semaphore(1)
-distanceThread = None
+distanceMapLock = threading.Lock()
+
+# Optional process pool (see startPool) computing the distances away from
+# the game's interpreter lock
+distancePool = None
 
 def waitOnDistanceCalculator(t):
-  global distanceThread
-  if distanceThread != None:
+  if [future for future in distanceMap.values() if not future.isDone()]:
     time.sleep(t)
 
+class DistanceFuture:
+  "MazeDistances of a layout that may still be being computed."
+  def __init__(self):
+    self.done = threading.Event()
+    self.distances = None
+    self.error = None
+
+  def isDone(self):
+    return self.done.isSet()
+
+  def set(self, distances, error=None):
+    self.distances = distances
+    self.error = error
+    self.done.set()
+
+  def get(self):
+    self.done.wait()
+    if self.error is not None:
+      raise self.error
+    return self.distances
+
+def getFuture(walls):
+  """
+  Returns (future, isNew) for a wall grid.  The caller that gets isNew
+  must compute the distances and set them on the future.
+  """
+  distanceMapLock.acquire()
+  try:
+    if walls in distanceMap:
+      return distanceMap[walls], False
+    future = DistanceFuture()
+    distanceMap[walls] = future
+    return future, True
+  finally:
+    distanceMapLock.release()
+
 class DistanceCalculator(threading.Thread):
   def setAttr(self, layout, distancer, default = 10000):
     self.layout = layout
@@ -124,68 +207,154 @@ class DistanceCalculator(threading.Thread):
     self.default = default
 
   def run(self):
-    global distanceMap, distanceThread
-    distanceMapSemaphore.acquire()
+    future, isNew = getFuture(self.layout.walls)
+    if isNew:
+      try:
+        distances = loadDistances(self.layout)
+      except Exception, e:
+        # Let the next Distancer of this layout try again
+        distanceMapLock.acquire()
+        del distanceMap[self.layout.walls]
+        distanceMapLock.release()
+        future.set(None, e)
+        raise
+      print >>sys.stdout, '[Distancer]: Switching to maze distances'
+      future.set(distances)
+    self.distancer._distances = future.get()
 
-    if self.layout.walls not in distanceMap:
-      if distanceThread != None: raise Exception('Multiple distance threads')
-      distanceThread = self
+def startPool(processes=None):
+  """
+  Computes the distances of new layouts in a pool of processes instead of
+  in the calling thread.  The pool lives until the program exits.
+  """
+  global distancePool
+  if distancePool is None:
+    distancePool = multiprocessing.Pool(processes)
+    atexit.register(stopPool)
 
-      distances = computeDistances(self.layout)
-      print >>sys.stdout, '[Distancer]: Switching to maze distances'
+def stopPool():
+  global distancePool
+  if distancePool is not None:
+    distancePool.terminate()
+    distancePool = None
 
-      distanceMap[self.layout.walls] = distances
-      distanceThread = None
-    else:
-      distances = distanceMap[self.layout.walls]
+# Directory where the distance matrices of every layout seen are kept, so
+# later runs (and other processes) map them instead of recomputing them.
+# None disables the cache.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "distanceCache")
 
-    distanceMapSemaphore.release()
-    self.distancer._distances = distances
+# Distance between cells that can't reach each other
+UNREACHABLE = numpy.iinfo(numpy.int32).max
+
+class MazeDistances:
+    """
+    All-pairs maze distances of a layout: matrix[i, j] is the distance
+    between the free cells with ids i and j, and cellIds maps positions to
+    ids (see Layout.getCellIds).
+    """
+    def __init__(self, cellIds, matrix):
+        self.cellIds = cellIds
+        self.matrix = matrix
+
+    def get(self, id1, id2):
+        "Distance between two cell ids, sys.maxint if they are not connected."
+        distance = self.matrix.item(id1, id2)
+        if distance == UNREACHABLE:
+            return sys.maxint
+        return distance
 
 def computeDistances(layout):
-    distances = {}
-    allNodes = layout.walls.asList(False)
-    for source in allNodes:
-        dist = {}
-        closed = {}
-        for node in allNodes:
-            dist[node] = sys.maxint
-        import util
-        queue = util.PriorityQueue()
-        queue.push(source, 0)
-        dist[source] = 0
-        while not queue.isEmpty():
-            node = queue.pop()
-            if node in closed:
-                continue
-            closed[node] = True
-            nodeDist = dist[node]
-            adjacent = []
-            x, y = node
-            if not layout.isWall((x,y+1)):
-                adjacent.append((x,y+1))
-            if not layout.isWall((x,y-1)):
-                adjacent.append((x,y-1) )
-            if not layout.isWall((x+1,y)):
-                adjacent.append((x+1,y) )
-            if not layout.isWall((x-1,y)):
-                adjacent.append((x-1,y))
-            for other in adjacent:
-                if not other in dist:
-                    continue
-                oldDist = dist[other]
-                newDist = nodeDist+1
-                if newDist < oldDist:
-                    dist[other] = newDist
-                    queue.push(other, newDist)
-        for target in allNodes:
-            distances[(target, source)] = dist[target]
+    """
+    Every move costs the same, so one breadth first search from each free
+    cell finds its row of distances.
+    """
+    cells = layout.getFreeCells()
+    ids = layout.getCellIds()
+    neighbours = []
+    for x, y in cells:
+        adjacent = [(x,y+1), (x,y-1), (x+1,y), (x-1,y)]
+        neighbours.append([ids[other] for other in adjacent if other in ids])
+
+    numCells = len(cells)
+    matrix = numpy.empty((numCells, numCells), dtype=numpy.int32)
+    for source in range(numCells):
+        row = [UNREACHABLE] * numCells
+        row[source] = 0
+        frontier = [source]
+        distance = 0
+        while frontier:
+            distance += 1
+            nextFrontier = []
+            for node in frontier:
+                for other in neighbours[node]:
+                    if row[other] == UNREACHABLE:
+                        row[other] = distance
+                        nextFrontier.append(other)
+            frontier = nextFrontier
+        matrix[source] = row
+    return MazeDistances(ids, matrix)
+
+def cacheFile(walls):
+    "File of the distance cache for a wall grid, named after a hash of the walls."
+    key = hashlib.sha1("%d %d\n%s" % (walls.width, walls.height, walls)).hexdigest()
+    return os.path.join(CACHE_DIR, key + ".npy")
+
+def loadDistances(layout):
+    """
+    MazeDistances of layout, read from the cache directory when an earlier
+    run already computed them.  The cached matrix is memory-mapped
+    read-only, so processes using the same layout share its pages.
+    """
+    if CACHE_DIR is None:
+        return computeDistances(layout)
+    fileName = cacheFile(layout.walls)
+    numCells = len(layout.getFreeCells())
+    try:
+        matrix = numpy.load(fileName, mmap_mode='r')
+        if matrix.shape == (numCells, numCells) and matrix.dtype == numpy.int32:
+            return MazeDistances(layout.getCellIds(), matrix)
+    except (IOError, OSError, ValueError):
+        pass
+    if distancePool is not None:
+        matrix = distancePool.apply(computeMatrix, (layout.layoutText,))
+        return MazeDistances(layout.getCellIds(), matrix)
+    distances = computeDistances(layout)
+    saveDistances(fileName, distances.matrix)
     return distances
 
+def computeMatrix(layoutText):
+    """
+    Distance matrix of the layout described by layoutText, for the workers
+    of distancePool.  The worker also fills the cache.
+    """
+    layout = layouts.Layout(layoutText)
+    distances = computeDistances(layout)
+    if CACHE_DIR is not None:
+        saveDistances(cacheFile(layout.walls), distances.matrix)
+    return distances.matrix
+
+def saveDistances(fileName, matrix):
+    """
+    Writes a matrix to the cache.  It goes to a temporary file first and is
+    renamed into place, so readers never see a partial file.  Failing to
+    write the cache is not an error: the distances are just not kept.
+    """
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        fd, tempName = tempfile.mkstemp(suffix=".npy", dir=CACHE_DIR)
+        f = os.fdopen(fd, "wb")
+        try:
+            numpy.save(f, matrix)
+        finally:
+            f.close()
+        os.chmod(tempName, 0644)
+        os.rename(tempName, fileName)
+    except (IOError, OSError):
+        pass
 
 def getDistanceOnGrid(distances, pos1, pos2):
-    key = (pos1, pos2)
-    if key in distances:
-      return distances[key]
+    ids = distances.cellIds
+    if pos1 in ids and pos2 in ids:
+      return distances.get(ids[pos1], ids[pos2])
     return 100000
-
@@ -0,0 +1,438 @@
+# exportModels.py
+# ---------------
+# Converts serialized Weka models into the NumPy bundles evaluated by
+# nativeModels.py.  Exporting needs the JVM (see wekaI.py); using the
+# exported model afterwards does not.
+#
+# USAGE:   python exportModels.py [--check <test arff> [--expected <labels>]] <kind> <model> <arff> <output.npz>
+# EXAMPLE: python exportModels.py j48 j48_attselkeyboard_cv.model training_keyboard_present_attsel.arff j48_attselkeyboard_cv.npz
+#          python exportModels.py ibk ibk1_noghosttutorial1_cv.model training_tutorial1_present_noghostdir.arff ibk1_noghosttutorial1_cv.npz
+#          python exportModels.py rf rf_attselkeyboard_cv.model training_keyboard_present_attsel.arff rf_attselkeyboard_cv.npz
+#          python exportModels.py --check test_samemaps_keyboard.arff smo smo_attselkeyboard_cv.model training_keyboard_present_attsel.arff smo_attselkeyboard_cv.npz
+#
+# The arff file must be the one the model was trained with; its header
+# (class last) is stored in the bundle.  With --check, the exported model
+# and Weka then classify every row of the test file and the command fails
+# if any prediction differs; --expected also saves Weka's predictions, so
+# the bundle can become a fixture of testNativeModels.py.  No exported model
+# has been checked this way yet, and the fixtures there are hand-written.
+
+import json
+import sys
+import javabridge
+import numpy as np
+import arffData
+from featureExtractor import schemaFor
+import nativeModels
+import wekaI
+
+def saveBundle(fileName, attributes, **arrays):
+    header = [[a.name, a.values] for a in attributes]
+    np.savez(fileName, header=np.array(json.dumps(header)), **arrays)
+
+class TreeBuilder:
+    "Accumulates the nodes of one or more trees in the layout used by nativeModels.DecisionTree."
+
+    def __init__(self, numClasses):
+        self.numClasses = numClasses
+        self.attribute = []
+        self.threshold = []
+        self.children = []
+        self.weights = []
+        self.distribution = []
+
+    def addNode(self, attribute=-1, threshold=0.0, distribution=None):
+        self.attribute.append(attribute)
+        self.threshold.append(threshold)
+        self.children.append({})
+        self.weights.append({})
+        if distribution is None:
+            distribution = [0.0] * self.numClasses
+        self.distribution.append(distribution)
+        return len(self.attribute) - 1
+
+    def setChild(self, node, branch, child, weight=0.0):
+        self.children[node][branch] = child
+        self.weights[node][branch] = weight
+
+    def arrays(self):
+        width = max([1] + [max(c.keys()) + 1 for c in self.children if c])
+        children = np.empty((len(self.children), width), dtype=np.int32)
+        children.fill(-1)
+        weights = np.zeros((len(self.children), width))
+        for node, branches in enumerate(self.children):
+            for branch, child in branches.items():
+                children[node, branch] = child
+                weights[node, branch] = self.weights[node][branch]
+        return dict(attribute=np.array(self.attribute, dtype=np.int32),
+                    threshold=np.array(self.threshold, dtype=np.float64),
+                    children=children,
+                    weights=weights,
+                    distribution=np.array(self.distribution, dtype=np.float64).reshape(-1, self.numClasses))
+
+# The exporters read the fields of the Java objects directly (JNI ignores
+# their access modifiers): the toString() of the models only prints rounded
+# split points and the majority class of each node.
+
+def getField(jobject, name, signature):
+    return javabridge.get_field(jobject, name, signature)
+
+def hasField(jobject, name, signature):
+    try:
+        getField(jobject, name, signature)
+        return True
+    except javabridge.JavaException:
+        return False
+
+def objectArray(jarray):
+    if jarray is None:
+        return []
+    return javabridge.get_env().get_object_array_elements(jarray)
+
+def doubleArray(jarray):
+    if jarray is None:
+        return None
+    return javabridge.get_env().get_double_array_elements(jarray)
+
+##########
+# J48    #
+##########
+
+J48_TREE = "Lweka/classifiers/trees/j48/ClassifierTree;"
+J48_SPLIT = "Lweka/classifiers/trees/j48/ClassifierSplitModel;"
+J48_DISTRIBUTION = "Lweka/classifiers/trees/j48/Distribution;"
+
+class J48Distribution:
+    "The class counts a J48 node keeps per branch (a j48.Distribution)."
+
+    def __init__(self, jdistribution):
+        self.perClassPerBag = [doubleArray(row) for row in
+                               objectArray(getField(jdistribution, "m_perClassPerBag", "[[D"))]
+        self.perBag = doubleArray(getField(jdistribution, "m_perBag", "[D"))
+        self.perClass = doubleArray(getField(jdistribution, "m_perClass", "[D"))
+        self.total = getField(jdistribution, "totaL", "D")
+
+    def prob(self):
+        "Class probabilities of the whole node (Distribution.prob)."
+        if abs(self.total) < nativeModels.WEKA_SMALL:
+            return [0.0] * len(self.perClass)
+        return list(self.perClass / self.total)
+
+    def probInBag(self, bag):
+        "Class probabilities of one branch, those of the node if it is empty."
+        if self.perBag[bag] > nativeModels.WEKA_SMALL:
+            return list(self.perClassPerBag[bag] / self.perBag[bag])
+        return self.prob()
+
+    def weight(self, bag):
+        "Share of the node's instances that went through a branch."
+        return self.perBag[bag] / self.total
+
+def addJ48Tree(builder, tree):
+    """
+    Appends the ClassifierTree tree and returns its index.  J48 predicts for
+    an empty son the probabilities of its branch at the parent, so empty sons
+    become leaves with those, and they get no weight because J48 skips them
+    when it splits an instance with a missing value.
+    """
+    split = getField(tree, "m_localModel", J48_SPLIT)
+    distribution = J48Distribution(getField(split, "m_distribution", J48_DISTRIBUTION))
+    if getField(tree, "m_isLeaf", "Z"):
+        return builder.addNode(distribution=distribution.prob())
+    if not javabridge.is_instance_of(split, "weka/classifiers/trees/j48/C45Split"):
+        raise Exception("Only J48 trees with C45Split nodes can be exported (no binary splits)")
+    node = builder.addNode(getField(split, "m_attIndex", "I"), getField(split, "m_splitPoint", "D"),
+                           distribution.prob())
+    for branch, son in enumerate(objectArray(getField(tree, "m_sons", "[" + J48_TREE))):
+        if getField(son, "m_isEmpty", "Z"):
+            builder.setChild(node, branch, builder.addNode(distribution=distribution.probInBag(branch)))
+        else:
+            builder.setChild(node, branch, addJ48Tree(builder, son), distribution.weight(branch))
+    return node
+
+def flattenJ48(classifier, attributes):
+    """
+    Reads the tree from the Java objects: J48.toString() rounds the split
+    points, which would send the instances between the printed and the real
+    value down the wrong branch.
+    """
+    builder = TreeBuilder(len(attributes[-1].values))
+    addJ48Tree(builder, getField(classifier.jobject, "m_root", J48_TREE))
+    return builder.arrays()
+
+def exportJ48(modelName, arffName, outName):
+    attributes = arffData.readHeader(arffName)
+    classifier = wekaI.loadModel(modelName)
+    saveBundle(outName, attributes, **flattenJ48(classifier, attributes))
+
+#######
+# IBk #
+#######
+
+def flattenIBk(classifier, attributes):
+    """
+    Reads k, the distance weighting, the training instances and the ranges
+    of the distance function, which are what nativeModels.IBkPredictor
+    needs to find the same neighbours as Weka.
+    """
+    ibk = classifier.jobject
+    if not javabridge.is_instance_of(ibk, "weka/classifiers/lazy/IBk"):
+        raise Exception("Only IBk models can be exported as ibk; KStar and other lazy models need backend=weka")
+    if getField(ibk, "m_WindowSize", "I") > 0:
+        raise Exception("IBk models with a window size are not supported")
+    if getField(ibk, "m_CrossValidate", "Z") and not getField(ibk, "m_kNNValid", "Z"):
+        raise Exception("This IBk model chooses k on its first prediction; classify an instance with it in Weka first")
+    search = getField(ibk, "m_NNSearch", "Lweka/core/neighboursearch/NearestNeighbourSearch;")
+    if not javabridge.is_instance_of(search, "weka/core/neighboursearch/LinearNNSearch"):
+        raise Exception("Only IBk models with LinearNNSearch can be exported")
+    distance = getField(search, "m_DistanceFunction", "Lweka/core/DistanceFunction;")
+    if (not javabridge.is_instance_of(distance, "weka/core/EuclideanDistance")
+            or getField(distance, "m_DontNormalize", "Z")
+            or javabridge.call(distance, "getAttributeIndices", "()Ljava/lang/String;") != "first-last"):
+        raise Exception("Only IBk models with a normalised EuclideanDistance over every attribute can be exported")
+
+    train = getField(ibk, "m_Train", "Lweka/core/Instances;")
+    rows, instanceWeights = [], []
+    for i in range(javabridge.call(train, "numInstances", "()I")):
+        instance = javabridge.call(train, "instance", "(I)Lweka/core/Instance;", i)
+        rows.append(doubleArray(javabridge.call(instance, "toDoubleArray", "()[D")))
+        instanceWeights.append(javabridge.call(instance, "weight", "()D"))
+    # getRanges computes them if no instance has been classified yet
+    ranges = np.array([doubleArray(r) for r in
+                       objectArray(javabridge.call(distance, "getRanges", "()[[D"))])
+    return dict(k=np.array(getField(ibk, "m_kNN", "I")),
+                weighting=np.array(getField(ibk, "m_DistanceWeighting", "I")),
+                train=np.array(rows, dtype=np.float64).reshape(-1, len(attributes)),
+                instanceWeights=np.array(instanceWeights),
+                minimum=ranges[:, 0], maximum=ranges[:, 1])
+
+def exportIBk(modelName, arffName, outName):
+    attributes = arffData.readHeader(arffName)
+    classifier = wekaI.loadModel(modelName)
+    saveBundle(outName, attributes, **flattenIBk(classifier, attributes))
+
+################
+# RandomForest #
+################
+
+TREE = "Lweka/classifiers/trees/RandomTree$Tree;"
+
+def randomTreeRoot(randomTree):
+    "Returns the root node of a RandomTree (a RandomTree$Tree since Weka 3.7.10)."
+    if hasField(randomTree, "m_Tree", TREE):
+        return getField(randomTree, "m_Tree", TREE), "[" + TREE
+    return randomTree, "[Lweka/classifiers/trees/RandomTree;"
+
+def addRandomTree(builder, node, successorSignature):
+    """
+    Appends the subtree rooted at node and returns its index, or -1 if it is
+    an empty leaf: RandomTree then falls back to the parent's distribution,
+    which is what an empty branch does in nativeModels.DecisionTree.
+    """
+    attribute = getField(node, "m_Attribute", "I")
+    distribution = doubleArray(getField(node, "m_ClassDistribution", "[D"))
+    if distribution is not None and distribution.sum() > 0:
+        distribution = list(distribution / distribution.sum())
+    elif attribute < 0:
+        return -1
+    else:
+        distribution = None
+    index = builder.addNode(attribute, getField(node, "m_SplitPoint", "D"), distribution)
+    if attribute >= 0:
+        # m_Prop splits the instances with a missing value among the branches
+        proportions = doubleArray(getField(node, "m_Prop", "[D"))
+        for branch, successor in enumerate(objectArray(getField(node, "m_Successors", successorSignature))):
+            if successor is not None:
+                builder.setChild(index, branch, addRandomTree(builder, successor, successorSignature),
+                                 proportions[branch])
+    return index
+
+def flattenRandomForest(classifier, attributes):
+    forest = classifier.jobject
+    # Before Weka 3.7.10 RandomForest wrapped a Bagging instead of extending it
+    bagger = "Lweka/classifiers/meta/Bagging;"
+    if hasField(forest, "m_bagger", bagger):
+        forest = getField(forest, "m_bagger", bagger)
+    trees = objectArray(getField(forest, "m_Classifiers", "[Lweka/classifiers/Classifier;"))
+
+    builder = TreeBuilder(len(attributes[-1].values))
+    roots = []
+    for tree in trees:
+        root, successorSignature = randomTreeRoot(tree)
+        start = len(builder.attribute)
+        if addRandomTree(builder, root, successorSignature) < 0:
+            # A tree that never saw an instance predicts nothing
+            builder.addNode()
+        roots.append(start)
+    arrays = builder.arrays()
+    arrays['roots'] = np.array(roots, dtype=np.int32)
+    return arrays
+
+def exportRandomForest(modelName, arffName, outName):
+    attributes = arffData.readHeader(arffName)
+    classifier = wekaI.loadModel(modelName)
+    saveBundle(outName, attributes, **flattenRandomForest(classifier, attributes))
+
+#######
+# SMO #
+#######
+
+def intArray(jarray):
+    if jarray is None:
+        return None
+    return javabridge.get_env().get_int_array_elements(jarray)
+
+def smoFilter(smo, numColumns):
+    """
+    Returns the (multiply, add) pair of arrays equivalent to the filter SMO
+    applies after NominalToBinary.
+    """
+    multiply = np.ones(numColumns)
+    add = np.zeros(numColumns)
+    dataFilter = getField(smo, "m_Filter", "Lweka/filters/Filter;")
+    if dataFilter is None:
+        pass
+    elif javabridge.is_instance_of(dataFilter, "weka/filters/unsupervised/attribute/Normalize"):
+        low = doubleArray(getField(dataFilter, "m_MinArray", "[D"))
+        high = doubleArray(getField(dataFilter, "m_MaxArray", "[D"))
+        scale = getField(dataFilter, "m_Scale", "D")
+        translation = getField(dataFilter, "m_Translation", "D")
+        for j in range(numColumns):
+            if np.isnan(low[j]) or high[j] == low[j]:
+                multiply[j], add[j] = 0.0, 0.0
+            else:
+                multiply[j] = scale / (high[j] - low[j])
+                add[j] = translation - low[j] * multiply[j]
+    elif javabridge.is_instance_of(dataFilter, "weka/filters/unsupervised/attribute/Standardize"):
+        means = doubleArray(getField(dataFilter, "m_Means", "[D"))
+        deviations = doubleArray(getField(dataFilter, "m_StdDevs", "[D"))
+        for j in range(numColumns):
+            if deviations[j] > 0:
+                multiply[j] = 1.0 / deviations[j]
+            add[j] = -means[j] * multiply[j]
+    else:
+        raise Exception("Unsupported SMO filter")
+    # The class column is never filtered
+    multiply[-1], add[-1] = 0.0, 0.0
+    return multiply, add
+
+def flattenSMO(classifier, attributes):
+    smo = classifier.jobject
+    if not getField(smo, "m_KernelIsLinear", "Z"):
+        raise Exception("Only SMO models with a linear kernel can be exported")
+    if getField(smo, "m_fitLogisticModels", "Z"):
+        raise Exception("SMO models with logistic models are not supported")
+
+    columns = nativeModels.expandedColumns(attributes)
+    numColumns = columns[-1][0] + columns[-1][1] + 1
+    converter = getField(smo, "m_NominalToBinary", "Lweka/filters/unsupervised/attribute/NominalToBinary;")
+    if converter is not None:
+        outputFormat = javabridge.call(converter, "getOutputFormat", "()Lweka/core/Instances;")
+        if javabridge.call(outputFormat, "numAttributes", "()I") != numColumns:
+            raise Exception("Unexpected NominalToBinary output format")
+
+    weights, bias, pairs = [], [], []
+    machines = [objectArray(row) for row in objectArray(getField(smo, "m_classifiers", "[[Lweka/classifiers/functions/SMO$BinarySMO;"))]
+    for i, row in enumerate(machines):
+        for j in range(i + 1, len(row)):
+            machine = row[j]
+            sparseWeights = doubleArray(getField(machine, "m_sparseWeights", "[D"))
+            # Pairs of classes without training instances are skipped by Weka
+            if sparseWeights is None:
+                continue
+            dense = np.zeros(numColumns)
+            dense[intArray(getField(machine, "m_sparseIndices", "[I"))] = sparseWeights
+            dense[-1] = 0.0
+            weights.append(dense)
+            bias.append(getField(machine, "m_b", "D"))
+            pairs.append((i, j))
+
+    # Means and modes ReplaceMissingValues puts in place of missing values,
+    # none if SMO was told to skip its checks
+    replacement = np.empty(len(attributes))
+    replacement.fill(np.nan)
+    replacer = getField(smo, "m_Missing", "Lweka/filters/unsupervised/attribute/ReplaceMissingValues;")
+    if replacer is not None and not getField(smo, "m_checksTurnedOff", "Z"):
+        replacement = doubleArray(getField(replacer, "m_ModesAndMeans", "[D"))
+
+    multiply, add = smoFilter(smo, numColumns)
+    return dict(weights=np.array(weights).reshape(-1, numColumns), bias=np.array(bias),
+                pairs=np.array(pairs, dtype=np.int32).reshape(-1, 2), multiply=multiply, add=add,
+                replacement=replacement)
+
+def exportSMO(modelName, arffName, outName):
+    attributes = arffData.readHeader(arffName)
+    classifier = wekaI.loadModel(modelName)
+    saveBundle(outName, attributes, **flattenSMO(classifier, attributes))
+
+EXPORTERS = {
+    'j48': exportJ48,
+    'ibk': exportIBk,
+    'rf': exportRandomForest,
+    'smo': exportSMO,
+}
+
+##########
+# Parity #
+##########
+
+# The logs written by Game.run (e.g. test_samemaps_keyboard.arff) store in
+# their 'class' column the direction Pacman arrived with, which is the
+# 'move' attribute of the *_present training sets.
+PARITY_ALIASES = {'move': 'class'}
+
+def projectRows(testArff, attributes):
+    "Returns the rows of testArff with the columns of attributes (class excluded)."
+    testAttributes, rows = arffData.readArff(testArff)
+    columns = schemaFor(testAttributes).columnsFor(schemaFor(attributes), PARITY_ALIASES)
+    return [[row[c] for c in columns] for row in rows]
+
+def writeLabels(fileName, labels):
+    "Writes one label per line, '?' where there is no prediction."
+    f = open(fileName, "w")
+    try:
+        for label in labels:
+            if label is None:
+                label = "?"
+            f.write("%s\n" % label)
+    finally:
+        f.close()
+
+def checkParity(kind, modelName, arffName, outName, testArff, expectedName=None):
+    """
+    Compares the exported model with Weka on every row of testArff.  Weka's
+    predictions are also written to expectedName if given.
+    """
+    rows = projectRows(testArff, arffData.readHeader(arffName))
+    expected = wekaI.Weka().predict_batch(modelName, rows, arffName)
+    if expectedName:
+        writeLabels(expectedName, expected)
+    predictor = nativeModels.loadPredictor(kind, outName, arffName)
+    mismatches = 0
+    for x, label in zip(rows, expected):
+        if predictor.predict(x) != label:
+            mismatches += 1
+    print '%d/%d predictions match Weka' % (len(rows) - mismatches, len(rows))
+    return mismatches == 0
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser('python exportModels.py [--check <test arff> [--expected <labels>]] <%s> <model> <arff> <output.npz>' % '|'.join(sorted(EXPORTERS)))
+    parser.add_option('-c', '--check', dest='check', metavar='TEST_ARFF',
+                      help='compare the exported model with Weka on this file')
+    parser.add_option('-e', '--expected', dest='expected', metavar='FILE',
+                      help="with --check, write Weka's predictions to FILE (see testNativeModels.py)")
+    options, args = parser.parse_args()
+    if len(args) != 4 or args[0] not in EXPORTERS:
+        parser.print_usage()
+        sys.exit(1)
+    kind, modelName, arffName, outName = args
+    weka = wekaI.Weka()
+    weka.start_jvm()
+    try:
+        EXPORTERS[kind](modelName, arffName, outName)
+        if options.check and not checkParity(kind, modelName, arffName, outName, options.check,
+                                             options.expected):
+            sys.exit(1)
+    finally:
+        weka.stop_jvm()
@@ -0,0 +1,239 @@
+# featureExtractor.py
+# -------------------
+# Turns a busters GameState into the attribute values of an ARFF row.  The
+# attributes are given by name, in the order of the ARFF header, so the same
+# extractor serves the training logs written by Game.run and the instances
+# that BasicAgentAA hands to its classifier.
+#
+# Headers are parsed once and kept in a registry of FeatureSchemas, so every
+# model gets exactly the columns it was trained on and models sharing a
+# header (attsel, noghost, raw...) share the compiled extractor.
+
+import os
+import re
+
+import arffData
+from game import Directions
+
+# Columns written by printLineData, in order (Game.run appends next_score)
+LOG_FEATURES = ["pacmanx", "pacmany", "legalW", "legalE", "legalN", "legalS",
+                "numghost", "alivePacman"] + \
+               ["alive_Ghost%d" % i for i in range(1, 5)] + \
+               ["ghost%d%s" % (i, axis) for i in range(1, 5) for axis in "xy"] + \
+               ["g%d_%s" % (i, d) for i in range(1, 5)
+                for d in ["west", "stop", "east", "north", "south"]] + \
+               ["ghost%ddist" % i for i in range(1, 5)] + \
+               ["pac_dots", "distance_dots", "score", "class"]
+
+DIRECTIONS = [Directions.STOP, Directions.EAST, Directions.WEST,
+              Directions.NORTH, Directions.SOUTH]
+
+LEGAL_NAMES = {"W": Directions.WEST, "E": Directions.EAST,
+               "N": Directions.NORTH, "S": Directions.SOUTH}
+
+DIRECTION_NAMES = {"west": Directions.WEST, "stop": Directions.STOP,
+                   "east": Directions.EAST, "north": Directions.NORTH,
+                   "south": Directions.SOUTH}
+
+class StateReading:
+    """
+    Everything the features need from a GameState, read once per tick.
+    The distance to the nearest food is the only expensive read, so it is
+    skipped when no feature uses it.
+    """
+
+    def __init__(self, state, nearestFood=True):
+        self.position = state.getPacmanPosition()
+        self.legal = state.getLegalPacmanActions()
+        self.living = state.getLivingGhosts()
+        self.numGhosts = state.getNumAgents() - 1
+        self.ghostPositions = state.getGhostPositions()
+        directions = state.getGhostDirections()
+        self.ghostDirections = [directions.get(i) for i in range(self.numGhosts)]
+        self.ghostDistances = state.data.ghostDistances
+        self.numFood = state.getNumFood()
+        self.nearestFood = None
+        if nearestFood:
+            self.nearestFood = state.getDistanceNearestFood()
+        self.score = state.getScore()
+        self.direction = state.data.agentStates[0].getDirection()
+
+def ghostValue(values, ghost, default=None):
+    "Value for ghost number ghost (1-based), None if there is no such ghost."
+    if ghost > len(values):
+        return None
+    value = values[ghost - 1]
+    if value is None:
+        return default
+    return value
+
+def compileFeature(name):
+    """
+    Returns a function that computes the attribute called name from a
+    StateReading.  Unknown names raise an exception when the extractor is
+    built rather than on the first tick.
+    """
+    if name == "pacmanx":
+        return lambda r: r.position[0]
+    if name == "pacmany":
+        return lambda r: r.position[1]
+    if name == "numghost":
+        return lambda r: r.numGhosts
+    if name == "alivePacman":
+        return lambda r: int(r.living[0])
+    if name == "pac_dots":
+        return lambda r: r.numFood
+    if name == "distance_dots":
+        return lambda r: -1 if r.nearestFood is None else r.nearestFood
+    if name == "score":
+        return lambda r: r.score
+    if name in ("class", "move"):
+        return lambda r: r.direction
+    if name == "next_score":
+        # Only known once the next state exists; Game.run fills it in
+        return lambda r: None
+
+    match = re.match(r"legal([WENS])$", name)
+    if match:
+        action = LEGAL_NAMES[match.group(1)]
+        return lambda r: int(action in r.legal)
+    match = re.match(r"alive_Ghost(\d+)$", name)
+    if match:
+        ghost = int(match.group(1))
+        return lambda r: int(r.living[ghost]) if ghost <= r.numGhosts else None
+    match = re.match(r"ghost(\d+)([xy])$", name)
+    if match:
+        ghost, axis = int(match.group(1)), "xy".index(match.group(2))
+        def coordinate(r):
+            position = ghostValue(r.ghostPositions, ghost)
+            if position is None:
+                return None
+            return position[axis]
+        return coordinate
+    match = re.match(r"g(\d+)_(west|stop|east|north|south)$", name)
+    if match:
+        ghost, direction = int(match.group(1)), DIRECTION_NAMES[match.group(2)]
+        def oneHot(r):
+            # Ghosts that have not moved yet have no direction: count it as stop
+            current = ghostValue(r.ghostDirections, ghost, Directions.STOP)
+            if current is None:
+                return None
+            return int(current == direction)
+        return oneHot
+    match = re.match(r"ghost(\d+)dist$", name)
+    if match:
+        ghost = int(match.group(1))
+        return lambda r: ghostValue(r.ghostDistances, ghost, -1)
+
+    raise Exception("Don't know how to compute the attribute " + name)
+
+class FeatureExtractor:
+    """
+    Computes a fixed list of attributes from GameStates.
+
+      extractor = getSchema("training_keyboard_present.arff").extractor()
+      x = extractor.extract(gameState)
+
+    extract fills and returns the same list on every call, so callers that
+    keep the values around must copy them.  Values are numbers, direction
+    labels for nominal attributes and None where the state has no value
+    (e.g. the position of a fourth ghost on a two ghost map).
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.features = [compileFeature(name) for name in self.names]
+        self.values = [None] * len(self.names)
+        self.needsNearestFood = "distance_dots" in self.names
+
+    def extract(self, state):
+        reading = StateReading(state, self.needsNearestFood)
+        values = self.values
+        for i, feature in enumerate(self.features):
+            values[i] = feature(reading)
+        return values
+
+def formatRow(values):
+    "Comma separated ARFF data line, with ? for missing values."
+    return ", ".join(["?" if v is None else str(v) for v in values])
+
+class FeatureSchema:
+    """
+    The attributes of an ARFF header with the class as last attribute.
+
+      schema.names       attribute names, in header order
+      schema.index       name -> position in the header
+    """
+
+    def __init__(self, attributes):
+        self.attributes = list(attributes)
+        self.names = [a.name for a in self.attributes]
+        self.index = dict([(name, i) for i, name in enumerate(self.names)])
+        self.classIndex = len(self.attributes) - 1
+        self.features = None
+
+    def extractor(self):
+        """
+        FeatureExtractor for every attribute but the class.  It is compiled on
+        first use, so schemas only used to look up columns may contain
+        attributes the extractor does not know.
+        """
+        if self.features is None:
+            self.features = FeatureExtractor(self.names[:self.classIndex])
+        return self.features
+
+    def indexOf(self, name):
+        "Position of the attribute called name, or -1 if there is none."
+        return self.index.get(name, -1)
+
+    def columnsFor(self, other, aliases={}):
+        """
+        Positions in this schema of the non class attributes of other, so
+        rows of this schema can be cut down to what other's model expects.
+        aliases maps names of other that this schema stores under another name.
+        """
+        columns = []
+        for name in other.names[:other.classIndex]:
+            column = self.indexOf(name)
+            if column < 0:
+                column = self.indexOf(aliases.get(name, name))
+            if column < 0:
+                raise Exception("Attribute %s is missing from the data" % name)
+            columns.append(column)
+        return columns
+
+    def header(self, relation):
+        "ARFF header text, up to and including the @DATA line."
+        lines = ["@RELATION " + relation, ""]
+        lines += [str(a) for a in self.attributes]
+        lines += ["", "", "@DATA", ""]
+        return "\n".join(lines)
+
+# Registry of schemas by attribute declarations, and of ARFF files by path
+schemas = {}
+schemaFiles = {}
+
+def schemaFor(attributes):
+    "Returns the (shared) schema for a list of ArffAttributes."
+    key = tuple([(a.name, a.values and tuple(a.values)) for a in attributes])
+    if key not in schemas:
+        schemas[key] = FeatureSchema(attributes)
+    return schemas[key]
+
+def getSchema(fileName):
+    """
+    Returns the schema of an ARFF file.  The header is only read again if
+    the file changes on disk.
+    """
+    path = os.path.abspath(fileName)
+    mtime = os.path.getmtime(path)
+    if path not in schemaFiles or schemaFiles[path][0] != mtime:
+        schemaFiles[path] = (mtime, schemaFor(arffData.readHeader(path)))
+    return schemaFiles[path][1]
+
+# Layout of the training logs written by Game.run: the printLineData columns
+# plus the score of the following tick, which Game.run fills in
+LOG_SCHEMA = FeatureSchema(
+    [arffData.ArffAttribute(name) for name in LOG_FEATURES[:-1]] +
+    [arffData.ArffAttribute("class", DIRECTIONS),
+     arffData.ArffAttribute("next_score")])
@@ -190,8 +190,12 @@ class Grid:
 
     def __eq__(self, other):
         if other == None: return False
+        if isinstance(other, BitGrid): return other == self
         return self.data == other.data
 
+    def __ne__(self, other):
+        return not self == other
+
     def __hash__(self):
         # return hash(str(self))
         base = 1
@@ -274,6 +278,142 @@ class Grid:
                 bools.append(False)
         return bools
 
+class BitGrid:
+    """
+    A Grid of booleans stored as the bits of a single integer, cell (x,y)
+    being bit x * height + y (the cell order of Grid.packBits).  It is
+    accessed like a Grid, via grid[x][y], but counting, hashing, comparing
+    and copying work on the whole integer instead of cell by cell, and
+    copies share the integer until one of them changes.
+    """
+    def __init__(self, width, height, initialValue=False, bitRepresentation=None):
+        if initialValue not in [False, True]: raise Exception('Grids can only contain booleans')
+        self.CELLS_PER_INT = 30
+
+        self.width = width
+        self.height = height
+        self.bits = 0
+        if initialValue:
+            self.bits = (1 << (width * height)) - 1
+        if bitRepresentation:
+            self._unpackBits(bitRepresentation)
+
+    def fromGrid(grid):
+        "Returns a BitGrid with the same cells as a Grid."
+        g = BitGrid(grid.width, grid.height)
+        for x, y in grid.asList():
+            g.bits |= 1 << (x * grid.height + y)
+        return g
+    fromGrid = staticmethod(fromGrid)
+
+    def __getitem__(self, x):
+        if x < 0: x += self.width
+        if not 0 <= x < self.width: raise IndexError('Grid column out of range')
+        return BitGridColumn(self, x)
+
+    def __setitem__(self, x, column):
+        for y in range(self.height):
+            self.set(x, y, column[y])
+
+    def get(self, x, y):
+        return (self.bits >> (x * self.height + y)) & 1 == 1
+
+    def set(self, x, y, value):
+        bit = 1 << (x * self.height + y)
+        if value:
+            self.bits |= bit
+        else:
+            self.bits &= ~bit
+
+    def __str__(self):
+        out = [[str(self.get(x, y))[0] for x in range(self.width)] for y in range(self.height)]
+        out.reverse()
+        return '\n'.join([''.join(x) for x in out])
+
+    def __eq__(self, other):
+        # A Grid with the same cells is equal (and has the same hash)
+        if isinstance(other, Grid): other = BitGrid.fromGrid(other)
+        if not isinstance(other, BitGrid): return False
+        return self.bits == other.bits and self.width == other.width and self.height == other.height
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        # Same value as Grid.__hash__ for the same cells
+        return hash(self.bits)
+
+    def copy(self):
+        g = BitGrid(self.width, self.height)
+        g.bits = self.bits
+        return g
+
+    def deepCopy(self):
+        return self.copy()
+
+    def shallowCopy(self):
+        return self.copy()
+
+    def count(self, item =True ):
+        set = bin(self.bits).count('1')
+        if item:
+            return set
+        return self.width * self.height - set
+
+    def asList(self, key = True):
+        bits = self.bits
+        if not key:
+            bits = ~bits & ((1 << (self.width * self.height)) - 1)
+        list = []
+        while bits:
+            lowest = bits & -bits
+            index = lowest.bit_length() - 1
+            list.append( (index / self.height, index % self.height) )
+            bits ^= lowest
+        return list
+
+    def packBits(self):
+        """
+        Returns the same (width, height, bitPackedInts...) representation as
+        Grid.packBits.
+        """
+        bits = [self.width, self.height]
+        cells = self.width * self.height
+        size = self.CELLS_PER_INT
+        for start in range(0, cells - cells % size + 1, size):
+            chunk = (self.bits >> start) & ((1 << size) - 1)
+            # Grid packs the first cell of every chunk in its highest bit
+            bits.append(int(bin(chunk)[2:].zfill(size)[::-1], 2))
+        return tuple(bits)
+
+    def _unpackBits(self, bits):
+        size = self.CELLS_PER_INT
+        cells = self.width * self.height
+        value = 0
+        for i, packed in enumerate(bits):
+            if packed < 0: raise ValueError, "must be a positive integer"
+            value |= int(bin(packed)[2:].zfill(size)[::-1], 2) << (i * size)
+        self.bits = value & ((1 << cells) - 1)
+
+class BitGridColumn:
+    "Column x of a BitGrid, so that grid[x][y] reads and writes single cells."
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.x = x
+
+    def __getitem__(self, y):
+        if y < 0: y += self.grid.height
+        if not 0 <= y < self.grid.height: raise IndexError('Grid row out of range')
+        return self.grid.get(self.x, y)
+
+    def __setitem__(self, y, value):
+        if y < 0: y += self.grid.height
+        if not 0 <= y < self.grid.height: raise IndexError('Grid row out of range')
+        self.grid.set(self.x, y, value)
+
+    def __len__(self):
+        return self.grid.height
+
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1,2)):
         return bitRep
@@ -372,14 +512,24 @@ class GameStateData:
     """
 
     """
-    def __init__( self, prevState = None ):
+    def __init__( self, prevState = None, copyOnWrite = False ):
         """
         Generates a new data packet by copying information from its predecessor.
+
+        With copyOnWrite the new packet shares the food grid and the agent
+        states of its predecessor: whoever changes them must replace the food
+        grid with a copy first and get agent states through mutableAgentState.
         """
+        self._ownedAgentStates = None
         if prevState != None:
-            self.food = prevState.food.shallowCopy()
             self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            if copyOnWrite:
+                self.food = prevState.food
+                self.agentStates = prevState.agentStates[:]
+                self._ownedAgentStates = [False for agentState in self.agentStates]
+            else:
+                self.food = prevState.food.shallowCopy()
+                self.agentStates = self.copyAgentStates( prevState.agentStates )
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
@@ -395,13 +545,24 @@ class GameStateData:
     def deepCopy( self ):
         state = GameStateData( self )
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        # The layout never changes during a game, so it is shared
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
         state._capsuleEaten = self._capsuleEaten
         return state
 
+    def mutableAgentState( self, index ):
+        """
+        Returns agentStates[index] after copying it if it is still shared with
+        the packet this one was generated from.
+        """
+        owned = self._ownedAgentStates
+        if owned is not None and not owned[index]:
+            self.agentStates[index] = self.agentStates[index].copy()
+            owned[index] = True
+        return self.agentStates[index]
+
     def copyAgentStates( self, agentStates ):
         copiedStates = []
         for agentState in agentStates:
@@ -488,7 +649,7 @@ class GameStateData:
         """
         Creates an initial game state from a layout array (see layout.py).
         """
-        self.food = layout.food.copy()
+        self.food = BitGrid.fromGrid(layout.food)
         #self.capsules = []
         self.capsules = layout.capsules[:]
         self.layout = layout
@@ -520,7 +681,7 @@ class Game:
     The Game manages the control flow, soliciting actions from agents.
     """
 
-    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False ):
+    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False, dataWriter=None ):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -535,6 +696,18 @@ class Game:
         self.agentTimeout = False
         import cStringIO
         self.agentOutput = [cStringIO.StringIO() for agent in agents]
+        # Where the lines of agents with printLineData go (a LookAheadLabeller)
+        self.dataWriter = dataWriter
+
+    def observeState(self):
+        """
+        Copy of the state that is handed to the agent about to move.  States
+        that provide getObservation build a read-only view of themselves in
+        constant time; others are deep-copied.
+        """
+        if hasattr(self.state, 'getObservation'):
+            return self.state.getObservation()
+        return self.state.deepCopy()
 
     def getProgress(self):
         if self.gameOver:
@@ -574,6 +747,7 @@ class Game:
         """
         self.display.initialize(self.state.data)
         self.numMoves = 0
+        self.checkDataAgents()
 
         ###self.display.initialize(self.state.makeObservation(1).data)
         # inform learning agents of the game start
@@ -616,7 +790,6 @@ class Game:
         agentIndex = self.startingIndex
         numAgents = len( self.agents )
         step = 0
-        restart = True
         while not self.gameOver:
             # Fetch the next agent
             agent = self.agents[agentIndex]
@@ -631,7 +804,7 @@ class Game:
                         timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
                         try:
                             start_time = time.time()
-                            observation = timed_func(self.state.deepCopy())
+                            observation = timed_func(self.observeState())
                         except TimeoutFunctionException:
                             skip_action = True
                         move_time += time.time() - start_time
@@ -641,10 +814,10 @@ class Game:
                         self.unmute()
                         return
                 else:
-                    observation = agent.observationFunction(self.state.deepCopy())
+                    observation = agent.observationFunction(self.observeState())
                 self.unmute()
             else:
-                observation = self.state.deepCopy()
+                observation = self.observeState()
             # Solicit an action
             action = None
             step += 1
@@ -710,90 +883,8 @@ class Game:
 
 
 
-            #ESTA VA A SER LA FUNCION QUE PRINTEE TODOS LOS ATRIBUTOS###############################################################################
-
-            if restart is True:
-                score = None
-            else:
-                if hasattr(agent, "scorefun"):
-                    score = agent.scorefun(self.state)
-
-            if hasattr(agent, "printLineData"):
-                if not os.path.exists("prueba.arff"):
-
-                    header = "@RELATION pacman\n" \
-                             "\n" \
-                             "@ATTRIBUTE pacmanx NUMERIC\n" \
-                             "@ATTRIBUTE pacmany NUMERIC\n" \
-                             "@ATTRIBUTE legalW NUMERIC\n" \
-                             "@ATTRIBUTE legalE NUMERIC\n" \
-                             "@ATTRIBUTE legalN NUMERIC\n" \
-                             "@ATTRIBUTE legalS NUMERIC\n" \
-                             "@ATTRIBUTE numghost NUMERIC\n" \
-                             "@ATTRIBUTE alivePacman NUMERIC\n" \
-                             "@ATTRIBUTE alive_Ghost1 NUMERIC\n" \
-                             "@ATTRIBUTE alive_Ghost2 NUMERIC\n" \
-                             "@ATTRIBUTE alive_Ghost3 NUMERIC\n" \
-                             "@ATTRIBUTE alive_Ghost4 NUMERIC\n" \
-                             "@ATTRIBUTE ghost1x NUMERIC\n" \
-                             "@ATTRIBUTE ghost1y NUMERIC\n" \
-                             "@ATTRIBUTE ghost2x NUMERIC\n" \
-                             "@ATTRIBUTE ghost2y NUMERIC\n" \
-                             "@ATTRIBUTE ghost3x NUMERIC\n" \
-                             "@ATTRIBUTE ghost3y NUMERIC\n" \
-                             "@ATTRIBUTE ghost4x NUMERIC\n" \
-                             "@ATTRIBUTE ghost4y NUMERIC\n" \
-                             "@ATTRIBUTE g1_west NUMERIC\n"\
-                             "@ATTRIBUTE g1_stop NUMERIC\n" \
-                             "@ATTRIBUTE g1_east NUMERIC\n" \
-                             "@ATTRIBUTE g1_north NUMERIC\n" \
-                             "@ATTRIBUTE g1_south NUMERIC\n" \
-                             "@ATTRIBUTE g2_west NUMERIC\n" \
-                             "@ATTRIBUTE g2_stop NUMERIC\n" \
-                             "@ATTRIBUTE g2_east NUMERIC\n" \
-                             "@ATTRIBUTE g2_north NUMERIC\n" \
-                             "@ATTRIBUTE g2_south NUMERIC\n"\
-                             "@ATTRIBUTE g3_west NUMERIC\n"\
-                             "@ATTRIBUTE g3_stop NUMERIC\n" \
-                             "@ATTRIBUTE g3_east NUMERIC\n" \
-                             "@ATTRIBUTE g3_north NUMERIC\n" \
-                             "@ATTRIBUTE g3_south NUMERIC\n" \
-                             "@ATTRIBUTE g4_west NUMERIC\n"\
-                             "@ATTRIBUTE g4_stop NUMERIC\n" \
-                             "@ATTRIBUTE g4_east NUMERIC\n" \
-                             "@ATTRIBUTE g4_north NUMERIC\n" \
-                             "@ATTRIBUTE g4_south NUMERIC\n" \
-                             "@ATTRIBUTE ghost1dist NUMERIC\n" \
-                             "@ATTRIBUTE ghost2dist NUMERIC\n" \
-                             "@ATTRIBUTE ghost3dist NUMERIC\n" \
-                             "@ATTRIBUTE ghost4dist NUMERIC\n" \
-                             "@ATTRIBUTE pac_dots NUMERIC\n" \
-                             "@ATTRIBUTE distance_dots NUMERIC\n" \
-                             "@ATTRIBUTE score NUMERIC\n" \
-                             "@ATTRIBUTE class {Stop, East, West, North, South}\n" \
-                             "@ATTRIBUTE next_score NUMERIC\n" \
-                             "\n" \
-                             "\n" \
-                             "@DATA\n"
-
-                    with open("prueba.arff", "a") as infile:
-                        infile.write(header)
-                        infile.write(agent.printLineData(self.state))
-                        restart = False
-
-                else:
-                    with open("prueba.arff", "a") as infile:
-                        if score is not None:
-                            infile.write(", " + str(score) + "\n" + agent.printLineData(self.state))
-                        else:
-                            infile.write("\n" + agent.printLineData(self.state))
-                            restart = False
-
-
-
-
-
-
+            if self.dataWriter is not None and hasattr(agent, "printLineData"):
+                self.dataWriter.addRow(self.lineData(agent), self.scoreFor(agent))
 
             # Change the display
             self.display.update( self.state.data )
@@ -824,8 +915,30 @@ class Game:
                     return
         self.display.finish()
 
-        with open("prueba.arff", "a") as infile:
-            infile.write(", 99999999")
-            restart = False
+        if self.dataWriter is not None:
+            self.dataWriter.endGame()
 
-        self.agents[0].weka.stop_jvm()
+    def checkDataAgents(self):
+        """
+        Fails before the first move if an agent only has printLineData and
+        the data writer needs the values of every column (columnar logs).
+        """
+        if self.dataWriter is None or self.dataWriter.takesLines():
+            return
+        for agent in self.agents:
+            if hasattr(agent, "printLineData") and not hasattr(agent, "getLineData"):
+                raise Exception("%s has printLineData but not getLineData, which the columns "
+                                "data format needs" % agent.__class__.__name__)
+
+    def lineData(self, agent):
+        "Values of the data line for the current state, without the targets."
+        if hasattr(agent, "getLineData"):
+            return list(agent.getLineData(self.state))
+        # Agents that only know how to print their line (ARFF logs only,
+        # see checkDataAgents)
+        return [agent.printLineData(self.state)]
+
+    def scoreFor(self, agent):
+        if hasattr(agent, "scorefun"):
+            return agent.scorefun(self.state)
+        return self.state.getScore()
@@ -34,6 +34,15 @@ class GhostAgent( Agent ):
         "Returns a Counter encoding a distribution over actions from the provided state."
         util.raiseNotDefined()
 
+    def getTransitionKey(self, state):
+        """
+        Returns what getDistribution depends on in state besides the ghost's
+        own position, so inference modules can reuse the transition tables
+        built from other states with the same key.  None (the default) means
+        the tables can't be reused.
+        """
+        return None
+
 class RandomGhost( GhostAgent ):
     "A ghost that chooses a legal action uniformly at random."
     def getDistribution( self, state ):
@@ -42,10 +51,16 @@ class RandomGhost( GhostAgent ):
         dist.normalize()
         return dist
 
+    def getTransitionKey( self, state ):
+        return ()
+
 class StaticGhost( GhostAgent ):
     def getDistribution( self, state):
 	return []
 
+    def getTransitionKey( self, state ):
+        return ()
+
 class DirectionalGhost( GhostAgent ):
     "A ghost that prefers to rush Pacman, or flee when scared."
     def __init__( self, index, prob_attack=0.8, prob_scaredFlee=0.8 ):
@@ -69,10 +84,7 @@ class DirectionalGhost( GhostAgent ):
 
         # Select best actions given the state
         distancesToPacman = [manhattanDistance( pos, pacmanPosition ) for pos in newPositions]
-        
-        print(distancesToPacman)
-        print(isScared)
-        
+
         if isScared:
             bestScore = max( distancesToPacman )
             bestProb = self.prob_scaredFlee
@@ -87,3 +99,6 @@ class DirectionalGhost( GhostAgent ):
         for a in legalActions: dist[a] += ( 1-bestProb ) / len(legalActions)
         dist.normalize()
         return dist
+
+    def getTransitionKey( self, state ):
+        return ( self.prob_attack, self.prob_scaredFlee, state.getPacmanPosition() )
@@ -17,6 +17,86 @@ import util
 import random
 import busters
 import game
+import numpy
+
+# Most moves a ghost has from a cell: the four directions and stop
+MAX_MOVES = 5
+
+class CellSpace:
+    """
+    The free cells of a layout, numbered as in Layout.getCellIds(), and the
+    arrays that the inference modules share to work on whole belief vectors
+    at once: the coordinates of every cell, which cells a ghost can be in
+    (everything but the prison row), the Manhattan distance from the cells
+    Pacman has been in to every cell and the emission table for distances
+    within the layout (see busters.getEmissionTable).  It also keeps the ghost
+    transition tables (see getTransitionTable).
+    """
+
+    def __init__(self, layout):
+        self.cells = layout.getFreeCells()
+        self.cellIds = layout.getCellIds()
+        self.coordinates = numpy.array(self.cells, dtype=int)
+        self.legal = self.coordinates[:, 1] > 1
+        self.maxDistance = int((self.coordinates.max(axis=0) - self.coordinates.min(axis=0)).sum())
+        self.emissions = busters.getEmissionTable(self.maxDistance)
+        self.manhattanRows = {}
+        self.transitions = {}
+
+    def manhattanRow(self, pos):
+        "Manhattan distances from pos to every cell, cached per position."
+        if pos not in self.manhattanRows:
+            point = numpy.array([int(pos[0]), int(pos[1])])
+            self.manhattanRows[pos] = numpy.abs(self.coordinates - point).sum(axis=1)
+        return self.manhattanRows[pos]
+
+    def likelihood(self, noisyDistance, pacmanPosition):
+        "P( noisyDistance | ghost in the cell ) for every cell."
+        if noisyDistance >= len(self.emissions):
+            # Too far for any cell of the layout
+            return numpy.zeros(len(self.cells))
+        return self.emissions[noisyDistance][self.manhattanRow(pacmanPosition)]
+
+    def toCounter(self, vector):
+        "Counter over positions with the non-zero entries of a vector over cells."
+        dist = util.Counter()
+        for i in numpy.flatnonzero(vector):
+            dist[self.cells[i]] = float(vector[i])
+        return dist
+
+cellSpaces = {}
+def getCellSpace(layout):
+    "Returns the (shared) CellSpace of a layout."
+    if layout.walls not in cellSpaces:
+        cellSpaces[layout.walls] = CellSpace(layout)
+    return cellSpaces[layout.walls]
+
+def newRandomState():
+    """
+    numpy random generator for a particle filter, seeded from the random
+    module so that fixing its seed (busters.py -f) fixes the particles too.
+    """
+    return numpy.random.RandomState(random.randint(0, 2 ** 31 - 1))
+
+def systematicResample(weights, numSamples, randomState):
+    """
+    Indices of numSamples draws from weights (which need not be normalised)
+    by systematic resampling: evenly spaced points with a single random
+    offset on the cumulative weights.
+    """
+    cdf = numpy.cumsum(weights)
+    points = (randomState.random_sample() + numpy.arange(numSamples)) * (cdf[-1] / numSamples)
+    return numpy.minimum(numpy.searchsorted(cdf, points, side='right'), len(weights) - 1)
+
+def sampleMoves(destinations, weights, cells, randomState):
+    """
+    Moves one particle in each of cells to a cell drawn from the transition
+    table (destinations, weights).  The table must have the rows of cells.
+    """
+    cdf = weights.cumsum(axis=1)[cells]
+    points = randomState.random_sample(len(cells)) * cdf[:, -1]
+    moves = (cdf <= points[:, numpy.newaxis]).sum(axis=1)
+    return destinations[cells, moves]
 
 class InferenceModule:
     """
@@ -48,6 +128,10 @@ class InferenceModule:
         ghostPosition = gameState.getGhostPosition(self.index) # The position you set
         actionDist = self.ghostAgent.getDistribution(gameState)
         dist = util.Counter()
+        if len(actionDist) == 0:
+            # Ghosts without actions stop (see GhostAgent.getAction)
+            dist[ghostPosition] = 1.0
+            return dist
         for action, prob in actionDist.items():
             successorPosition = game.Actions.getSuccessor(ghostPosition, action)
             dist[successorPosition] = prob
@@ -71,6 +155,10 @@ class InferenceModule:
         gameState.data.agentStates[self.index] = game.AgentState(conf, False)
         return gameState
 
+    def getTransitionTable(self, gameState, rows=None):
+        "Transition table of this module's ghost (see getTransitionTable below)."
+        return getTransitionTable(self.space, self.ghostAgent, gameState, rows)
+
     def observeState(self, gameState):
         "Collects the relevant noisy distance observation and pass it along."
         distances = gameState.getNoisyGhostDistances()
@@ -83,6 +171,7 @@ class InferenceModule:
         "Initializes beliefs to a uniform distribution over all positions."
         # The legal positions do not include the ghost prison cells in the bottom left.
         self.legalPositions = [p for p in gameState.getWalls().asList(False) if p[1] > 1]
+        self.space = getCellSpace(gameState.data.layout)
         self.initializeUniformly(gameState)
 
     ######################################
@@ -115,10 +204,11 @@ class ExactInference(InferenceModule):
     """
 
     def initializeUniformly(self, gameState):
-        "Begin with a uniform distribution over ghost positions."
-        self.beliefs = util.Counter()
-        for p in self.legalPositions: self.beliefs[p] = 1.0
-        self.beliefs.normalize()
+        """
+        Begin with a uniform distribution over ghost positions.  The beliefs
+        are a vector over the cells of the layout's CellSpace.
+        """
+        self.beliefs = self.space.legal / float(self.space.legal.sum())
 
     def observe(self, observation, gameState):
         """
@@ -127,9 +217,9 @@ class ExactInference(InferenceModule):
         The noisyDistance is the estimated Manhattan distance to the ghost you
         are tracking.
 
-        The emissionModel below stores the probability of the noisyDistance for
-        any true distance you supply. That is, it stores P(noisyDistance |
-        TrueDistance).
+        The emission table of the layout (self.space.emissions) stores the
+        probability of the noisyDistance for any true distance you supply. That
+        is, row noisyDistance stores P(noisyDistance | TrueDistance).
 
         self.legalPositions is a list of the possible ghost positions (you
         should only consider positions that are in self.legalPositions).
@@ -145,105 +235,52 @@ class ExactInference(InferenceModule):
              captured).
         """
         noisyDistance = observation
-        emissionModel = busters.getObservationDistribution(noisyDistance)
         pacmanPosition = gameState.getPacmanPosition()
-       
-        "*** YOUR CODE HERE ***"
-        ##AA
-        '''print("Estamos Aqui")
-        print(pacmanPosition)
-        print(noisyDistance)
-        print(emissionModel)
-        print("Estamos Aqui")
-        ##move = Directions.WEST
-        #AA'''
-        ##util.raiseNotDefined()
-
-        # Replace this code with a correct observation update
-        # Be sure to handle the "jail" edge case where the ghost is eaten
-        # and noisyDistance is None
-        allPossible = util.Counter()
-        for p in self.legalPositions:
-            trueDistance = util.manhattanDistance(p, pacmanPosition)
-            if emissionModel[trueDistance] > 0:
-                allPossible[p] = 1.0
-
-        "*** END YOUR CODE HERE ***"
-
-        allPossible.normalize()
-        self.beliefs = allPossible
-
-    def elapseTime(self, gameState):
-        """
-        Update self.beliefs in response to a time step passing from the current
-        state.
-
-        The transition model is not entirely stationary: it may depend on
-        Pacman's current position (e.g., for DirectionalGhost).  However, this
-        is not a problem, as Pacman's current position is known.
-
-        In order to obtain the distribution over new positions for the ghost,
-        given its previous position (oldPos) as well as Pacman's current
-        position, use this line of code:
-
-          newPosDist = self.getPositionDistribution(self.setGhostPosition(gameState, oldPos))
 
-        Note that you may need to replace "oldPos" with the correct name of the
-        variable that you have used to refer to the previous ghost position for
-        which you are computing this distribution. You will need to compute
-        multiple position distributions for a single update.
-
-        newPosDist is a util.Counter object, where for each position p in
-        self.legalPositions,
-
-        newPostDist[p] = Pr( ghost is at position p at time t + 1 | ghost is at position oldPos at time t )
-
-        (and also given Pacman's current position).  You may also find it useful
-        to loop over key, value pairs in newPosDist, like:
-
-          for newPos, prob in newPosDist.items():
-            ...
-
-        *** GORY DETAIL AHEAD ***
-
-        As an implementation detail (with which you need not concern yourself),
-        the line of code at the top of this comment block for obtaining
-        newPosDist makes use of two helper methods provided in InferenceModule
-        above:
+        if noisyDistance is None:
+            self.beliefs = numpy.zeros(len(self.space.cells))
+            self.beliefs[self.space.cellIds[self.getJailPosition()]] = 1.0
+            return
 
-          1) self.setGhostPosition(gameState, ghostPosition)
-              This method alters the gameState by placing the ghost we're
-              tracking in a particular position.  This altered gameState can be
-              used to query what the ghost would do in this position.
+        # The emission model of every cell at once
+        likelihood = self.space.likelihood(noisyDistance, pacmanPosition)
 
-          2) self.getPositionDistribution(gameState)
-              This method uses the ghost agent to determine what positions the
-              ghost will move to from the provided gameState.  The ghost must be
-              placed in the gameState with a call to self.setGhostPosition
-              above.
+        self.beliefs *= likelihood
+        if self.beliefs.sum() == 0:
+            # The observation rules out every position believed possible:
+            # start again from the uniform prior
+            self.beliefs = self.space.legal * likelihood
+        total = self.beliefs.sum()
+        if total > 0:
+            self.beliefs /= total
 
-        It is worthwhile, however, to understand why these two helper methods
-        are used and how they combine to give us a belief distribution over new
-        positions after a time update from a particular position.
+    def elapseTime(self, gameState):
         """
-        "*** YOUR CODE HERE ***"
-        ##util.raiseNotDefined()
+        Update self.beliefs for a time step elapsing: the belief of every cell
+        is spread over the cells the ghost can move to, weighted by the ghost's
+        transition table (see getTransitionTable), given Pacman's current
+        position.
+        """
+        destinations, weights = self.getTransitionTable(gameState, numpy.flatnonzero(self.beliefs))
+        flow = weights * self.beliefs[:, numpy.newaxis]
+        self.beliefs = numpy.bincount(destinations.ravel(), flow.ravel(), len(self.beliefs))
 
     def getBeliefDistribution(self):
-        return self.beliefs
+        return self.space.toCounter(self.beliefs)
 
 class ParticleFilter(InferenceModule):
     """
     A particle filter for approximately tracking a single ghost.
 
-    Useful helper functions will include random.choice, which chooses an element
-    from a list uniformly at random, and util.sample, which samples a key from a
-    Counter by treating its values as probabilities.
+    The particles are a numpy array with the cell id (see CellSpace) of each
+    particle, so weighting, resampling and moving them are array operations
+    and the number of particles can grow well past the default.
     """
 
     def __init__(self, ghostAgent, numParticles=300):
         InferenceModule.__init__(self, ghostAgent);
         self.setNumParticles(numParticles)
+        self.random = newRandomState()
 
     def setNumParticles(self, numParticles):
         self.numParticles = numParticles
@@ -251,25 +288,15 @@ class ParticleFilter(InferenceModule):
 
     def initializeUniformly(self, gameState):
         """
-        Initializes a list of particles. Use self.numParticles for the number of
-        particles. Use self.legalPositions for the legal board positions where a
-        particle could be located.  Particles should be evenly (not randomly)
-        distributed across positions in order to ensure a uniform prior.
-
-        Note: the variable you store your particles in must be a list; a list is
-        simply a collection of unweighted variables (positions in this case).
-        Storing your particles as a Counter (where there could be an associated
-        weight with each position) is incorrect and may produce errors.
+        Initializes the particles, evenly (not randomly) distributed across
+        the legal positions in order to ensure a uniform prior.
         """
-        "*** YOUR CODE HERE ***"
+        legalCells = numpy.flatnonzero(self.space.legal).astype(numpy.int32)
+        self.particles = numpy.resize(legalCells, self.numParticles)
 
     def observe(self, observation, gameState):
         """
-        Update beliefs based on the given distance observation. Make sure to
-        handle the special case where all particles have weight 0 after
-        reweighting based on observation. If this happens, resample particles
-        uniformly at random from the set of legal positions
-        (self.legalPositions).
+        Update beliefs based on the given distance observation.
 
         A correct implementation will handle two special cases:
           1) When a ghost is captured by Pacman, all particles should be updated
@@ -280,48 +307,40 @@ class ParticleFilter(InferenceModule):
              checking if it has a noisyDistance of None.
 
           2) When all particles receive 0 weight, they should be recreated from
-             the prior distribution by calling initializeUniformly. The total
-             weight for a belief distribution can be found by calling totalCount
-             on a Counter object
-
-        util.sample(Counter object) is a helper method to generate a sample from
-        a belief distribution.
+             the prior distribution by calling initializeUniformly.
 
-        You may also want to use util.manhattanDistance to calculate the
-        distance between a particle and Pacman's position.
+        The particles are weighted with the emission table of the layout and
+        resampled systematically.
         """
         noisyDistance = observation
-        emissionModel = busters.getObservationDistribution(noisyDistance)
+        if noisyDistance is None:
+            self.particles[:] = self.space.cellIds[self.getJailPosition()]
+            return
         pacmanPosition = gameState.getPacmanPosition()
-        "*** YOUR CODE HERE ***"
-        ##util.raiseNotDefined()
+        weights = self.space.likelihood(noisyDistance, pacmanPosition)[self.particles]
+        if weights.sum() == 0:
+            self.initializeUniformly(gameState)
+            return
+        self.particles = self.particles[systematicResample(weights, self.numParticles, self.random)]
 
     def elapseTime(self, gameState):
         """
-        Update beliefs for a time step elapsing.
-
-        As in the elapseTime method of ExactInference, you should use:
-
-          newPosDist = self.getPositionDistribution(self.setGhostPosition(gameState, oldPos))
-
-        to obtain the distribution over new positions for the ghost, given its
-        previous position (oldPos) as well as Pacman's current position.
-
-        util.sample(Counter object) is a helper method to generate a sample from
-        a belief distribution.
+        Update beliefs for a time step elapsing: every particle moves to a
+        cell drawn from the ghost's transition table (see
+        getTransitionTable), given Pacman's current position.
         """
-        "*** YOUR CODE HERE ***"
-        ##util.raiseNotDefined()
+        destinations, weights = self.getTransitionTable(gameState, numpy.unique(self.particles))
+        self.particles = sampleMoves(destinations, weights, self.particles, self.random)
 
     def getBeliefDistribution(self):
         """
         Return the agent's current belief state, a distribution over ghost
         locations conditioned on all evidence and time passage. This method
-        essentially converts a list of particles into a belief distribution (a
+        essentially converts the particles into a belief distribution (a
         Counter object)
         """
-        "*** YOUR CODE HERE ***"
-       ## util.raiseNotDefined()
+        counts = numpy.bincount(self.particles, minlength=len(self.space.cells))
+        return self.space.toCounter(counts / float(len(self.particles)))
 
 class MarginalInference(InferenceModule):
     """
@@ -347,16 +366,16 @@ class MarginalInference(InferenceModule):
 
     def getBeliefDistribution(self):
         "Returns the marginal belief over a particular ghost by summing out the others."
-        jointDistribution = jointInference.getBeliefDistribution()
-        dist = util.Counter()
-        for t, prob in jointDistribution.items():
-            dist[t[self.index - 1]] += prob
-        return dist
+        return jointInference.getMarginalDistribution(self.index - 1)
 
 class JointParticleFilter:
     """
     JointParticleFilter tracks a joint distribution over tuples of all ghost
     positions.
+
+    The particles are a numpy array with a row per particle and a column per
+    ghost holding cell ids (see CellSpace), so every ghost is weighted and
+    moved for all particles at once.
     """
 
     def __init__(self, numParticles=600):
@@ -370,30 +389,24 @@ class JointParticleFilter:
         self.numGhosts = gameState.getNumAgents() - 1
         self.ghostAgents = []
         self.legalPositions = legalPositions
+        self.space = getCellSpace(gameState.data.layout)
+        self.random = newRandomState()
         self.initializeParticles()
 
     def initializeParticles(self):
         """
-        Initialize particles to be consistent with a uniform prior.
-
-        Each particle is a tuple of ghost positions. Use self.numParticles for
-        the number of particles. You may find the `itertools` package helpful.
-        Specifically, you will need to think about permutations of legal ghost
-        positions, with the additional understanding that ghosts may occupy the
-        same space. Look at the `itertools.product` function to get an
-        implementation of the Cartesian product.
-
-        Note: If you use itertools, keep in mind that permutations are not
-        returned in a random order; you must shuffle the list of permutations in
-        order to ensure even placement of particles across the board. Use
-        self.legalPositions to obtain a list of positions a ghost may occupy.
-
-        Note: the variable you store your particles in must be a list; a list is
-        simply a collection of unweighted variables (positions in this case).
-        Storing your particles as a Counter (where there could be an associated
-        weight with each position) is incorrect and may produce errors.
+        Initialize particles to be consistent with a uniform prior: every
+        ghost is spread evenly over the legal positions, independently of
+        the others (ghosts may occupy the same space).  The product of the
+        legal positions is too large to enumerate with four ghosts, so each
+        column is shuffled separately instead.
         """
-        "*** YOUR CODE HERE ***"
+        legalCells = numpy.array([self.space.cellIds[p] for p in self.legalPositions], dtype=numpy.int32)
+        self.particles = numpy.empty((self.numParticles, self.numGhosts), dtype=numpy.int32)
+        for i in range(self.numGhosts):
+            column = numpy.resize(legalCells, self.numParticles)
+            self.random.shuffle(column)
+            self.particles[:, i] = column
 
     def addGhostAgent(self, agent):
         """
@@ -408,12 +421,8 @@ class JointParticleFilter:
     def observeState(self, gameState):
         """
         Resamples the set of particles using the likelihood of the noisy
-        observations.
-
-        To loop over the ghosts, use:
-
-          for i in range(self.numGhosts):
-            ...
+        observations: the product over the ghosts of the emission table
+        entries of their columns.
 
         A correct implementation will handle two special cases:
           1) When a ghost is captured by Pacman, all particles should be updated
@@ -426,89 +435,58 @@ class JointParticleFilter:
           2) When all particles receive 0 weight, they should be recreated from
              the prior distribution by calling initializeParticles. After all
              particles are generated randomly, any ghosts that are eaten (have
-             noisyDistance of None) must be changed to the jail Position. This
-             will involve changing each particle if a ghost has been eaten.
-
-        self.getParticleWithGhostInJail is a helper method to edit a specific
-        particle. Since we store particles as tuples, they must be converted to
-        a list, edited, and then converted back to a tuple. This is a common
-        operation when placing a ghost in jail.
+             noisyDistance of None) must be changed to the jail Position.
         """
         pacmanPosition = gameState.getPacmanPosition()
         noisyDistances = gameState.getNoisyGhostDistances()
         if len(noisyDistances) < self.numGhosts:
             return
-        emissionModels = [busters.getObservationDistribution(dist) for dist in noisyDistances]
-
-        "*** YOUR CODE HERE ***"
 
-    def getParticleWithGhostInJail(self, particle, ghostIndex):
-        """
-        Takes a particle (as a tuple of ghost positions) and returns a particle
-        with the ghostIndex'th ghost in jail.
-        """
-        particle = list(particle)
-        particle[ghostIndex] = self.getJailPosition(ghostIndex)
-        return tuple(particle)
+        weights = numpy.ones(self.numParticles)
+        for i in range(self.numGhosts):
+            if noisyDistances[i] is not None:
+                weights *= self.space.likelihood(noisyDistances[i], pacmanPosition)[self.particles[:, i]]
+        if weights.sum() == 0:
+            self.initializeParticles()
+        else:
+            self.particles = self.particles[systematicResample(weights, self.numParticles, self.random)]
+        self.putCapturedInJail(noisyDistances)
+
+    def putCapturedInJail(self, noisyDistances):
+        "Moves the ghosts with no observation (captured) to their jail cells."
+        for i in range(self.numGhosts):
+            if noisyDistances[i] is None:
+                self.particles[:, i] = self.space.cellIds[self.getJailPosition(i)]
 
     def elapseTime(self, gameState):
         """
         Samples each particle's next state based on its current state and the
         gameState.
 
-        To loop over the ghosts, use:
-
-          for i in range(self.numGhosts):
-            ...
-
-        Then, assuming that `i` refers to the index of the ghost, to obtain the
-        distributions over new positions for that single ghost, given the list
-        (prevGhostPositions) of previous positions of ALL of the ghosts, use
-        this line of code:
-
-          newPosDist = getPositionDistributionForGhost(
-             setGhostPositions(gameState, prevGhostPositions), i, self.ghostAgents[i]
-          )
-
-        Note that you may need to replace `prevGhostPositions` with the correct
-        name of the variable that you have used to refer to the list of the
-        previous positions of all of the ghosts, and you may need to replace `i`
-        with the variable you have used to refer to the index of the ghost for
-        which you are computing the new position distribution.
-
-        As an implementation detail (with which you need not concern yourself),
-        the line of code above for obtaining newPosDist makes use of two helper
-        functions defined below in this file:
-
-          1) setGhostPositions(gameState, ghostPositions)
-              This method alters the gameState by placing the ghosts in the
-              supplied positions.
-
-          2) getPositionDistributionForGhost(gameState, ghostIndex, agent)
-              This method uses the supplied ghost agent to determine what
-              positions a ghost (ghostIndex) controlled by a particular agent
-              (ghostAgent) will move to in the supplied gameState.  All ghosts
-              must first be placed in the gameState using setGhostPositions
-              above.
-
-              The ghost agent you are meant to supply is
-              self.ghostAgents[ghostIndex-1], but in this project all ghost
-              agents are always the same.
+        Every ghost moves according to the transition table of its agent
+        (see getTransitionTable), which assumes that ghosts move
+        independently of each other's positions, as all the ghost agents in
+        this project do.
         """
-        newParticles = []
-        for oldParticle in self.particles:
-            newParticle = list(oldParticle) # A list of ghost positions
-            # now loop through and update each entry in newParticle...
-
-            "*** YOUR CODE HERE ***"
-
-            "*** END YOUR CODE HERE ***"
-            newParticles.append(tuple(newParticle))
-        self.particles = newParticles
+        for i in range(self.numGhosts):
+            column = self.particles[:, i]
+            destinations, weights = getTransitionTable(self.space, self.ghostAgents[i], gameState,
+                                                       numpy.unique(column))
+            self.particles[:, i] = sampleMoves(destinations, weights, column, self.random)
 
     def getBeliefDistribution(self):
-        "*** YOUR CODE HERE ***"
-        util.raiseNotDefined()
+        "Distribution over tuples of ghost positions given by the particles."
+        rows, counts = numpy.unique(self.particles, axis=0, return_counts=True)
+        dist = util.Counter()
+        cells = self.space.cells
+        for row, count in zip(rows.tolist(), counts.tolist()):
+            dist[tuple([cells[cell] for cell in row])] = count / float(self.numParticles)
+        return dist
+
+    def getMarginalDistribution(self, i):
+        "Distribution over the positions of the i-th ghost (0 is the first ghost)."
+        counts = numpy.bincount(self.particles[:, i], minlength=len(self.space.cells))
+        return self.space.toCounter(counts / float(self.numParticles))
 
 # One JointInference module is shared globally across instances of MarginalInference
 jointInference = JointParticleFilter()
@@ -522,6 +500,10 @@ def getPositionDistributionForGhost(gameState, ghostIndex, agent):
     ghostPosition = gameState.getGhostPosition(ghostIndex+1)
     actionDist = agent.getDistribution(gameState)
     dist = util.Counter()
+    if len(actionDist) == 0:
+        # Ghosts without actions stop (see GhostAgent.getAction)
+        dist[ghostPosition] = 1.0
+        return dist
     for action, prob in actionDist.items():
         successorPosition = game.Actions.getSuccessor(ghostPosition, action)
         dist[successorPosition] = prob
@@ -534,3 +516,43 @@ def setGhostPositions(gameState, ghostPositions):
         gameState.data.agentStates[index + 1] = game.AgentState(conf, False)
     return gameState
 
+def getTransitionTable(space, ghostAgent, gameState, rows=None):
+    """
+    Returns (destinations, weights), two arrays with a row per cell of
+    space and MAX_MOVES columns: the cell ids the ghost of ghostAgent can
+    move to from that cell and their probabilities, padded with zero weights.
+
+    The table is shared by every module and tick with the same ghost agent
+    type and transition key (see GhostAgent.getTransitionKey).  If the agent
+    has no key the table is built for this state only, and only for the
+    cells in rows when they are given.
+    """
+    key = None
+    if hasattr(ghostAgent, 'getTransitionKey'):
+        key = ghostAgent.getTransitionKey(gameState)
+    if key is None:
+        return buildTransitionTable(space, ghostAgent, gameState, rows)
+    key = (ghostAgent.__class__, key)
+    if key not in space.transitions:
+        space.transitions[key] = buildTransitionTable(space, ghostAgent, gameState)
+    return space.transitions[key]
+
+def buildTransitionTable(space, ghostAgent, gameState, rows=None):
+    "Queries the ghost agent from every cell (or the ones in rows)."
+    numCells = len(space.cells)
+    if rows is None:
+        rows = range(numCells)
+    destinations = numpy.repeat(numpy.arange(numCells, dtype=numpy.int32), MAX_MOVES)
+    destinations = destinations.reshape(numCells, MAX_MOVES)
+    weights = numpy.zeros((numCells, MAX_MOVES))
+    index = ghostAgent.index
+    ghostState = gameState.data.agentStates[index]
+    for i in rows:
+        conf = game.Configuration(space.cells[i], game.Directions.STOP)
+        gameState.data.agentStates[index] = game.AgentState(conf, False)
+        newPosDist = getPositionDistributionForGhost(gameState, index - 1, ghostAgent)
+        for j, (newPos, prob) in enumerate(newPosDist.items()):
+            destinations[i, j] = space.cellIds[newPos]
+            weights[i, j] = prob
+    gameState.data.agentStates[index] = ghostState
+    return destinations, weights
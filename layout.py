@@ -35,6 +35,8 @@ class Layout:
         self.processLayoutText(layoutText)
         self.layoutText = layoutText
         self.totalFood = len(self.food.asList())
+        self.freeCells = None
+        self.cellIds = None
         # self.initializeVisibilityMatrix()
 
     def getNumGhosts(self):
@@ -61,6 +63,21 @@ class Layout:
         else:
             self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
 
+    def getFreeCells(self):
+        """
+        Returns the positions that are not walls, in the order of
+        walls.asList(False).  The id of a cell is its index in this list.
+        """
+        if self.freeCells is None:
+            self.freeCells = self.walls.asList(False)
+            self.cellIds = dict([(cell, i) for i, cell in enumerate(self.freeCells)])
+        return self.freeCells
+
+    def getCellIds(self):
+        "Returns a dict from the positions that are not walls to their cell ids."
+        self.getFreeCells()
+        return self.cellIds
+
     def isWall(self, pos):
         x, col = pos
         return self.walls[x][col]
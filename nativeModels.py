@@ -0,0 +1,580 @@
+# nativeModels.py
+# ---------------
+# Evaluators for Weka models that have been exported to NumPy bundles with
+# exportModels.py.  None of them needs the JVM: they take the same input as
+# Weka.predict (a list of attribute values without the class) and return the
+# predicted class label.
+#
+# Only J48, IBk, RandomForest and SMO can be exported.  Other models, such as
+# KStar (kstar_*.model), still need the JVM: use them with backend=weka.
+
+import json
+import zipfile
+import numpy as np
+import util
+from arffData import ArffAttribute
+
+def loadBundle(fileName):
+    """
+    Loads an exported model.  Returns a dict with its arrays plus the model
+    header under 'attributes' (a list of ArffAttributes, class last).
+    """
+    if not zipfile.is_zipfile(fileName):
+        raise Exception("%s is not a model exported with exportModels.py; serialized Weka "
+                        "models (and KStar ones, which cannot be exported) need backend=weka" % fileName)
+    bundle = dict(np.load(fileName))
+    header = json.loads(str(bundle.pop('header')))
+    bundle['attributes'] = [ArffAttribute(name, values) for name, values in header]
+    return bundle
+
+# Weka's Utils.SMALL: differences below it count as equal
+WEKA_SMALL = 1e-6
+
+MISSING = float('nan')
+
+class NativePredictor:
+    """
+    Common code for the exported models: converting Weka.predict style inputs
+    into numeric vectors, nominal labels becoming their index as in Weka.
+    Missing values (None or '?') and labels the attribute does not declare
+    become NaN, Weka's missing value.
+    """
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.classAttribute = attributes[-1]
+        self.nominal = [a.isNominal() for a in attributes[:-1]]
+
+    def encode(self, x):
+        values = []
+        for attribute, value in zip(self.attributes, x):
+            if value is None or value == '?':
+                value = MISSING
+            elif attribute.isNominal():
+                value = attribute.indexOf(value)
+                if value < 0:
+                    value = MISSING
+            values.append(float(value))
+        return values
+
+    def predict(self, x):
+        "Returns the class label predicted for the list of values x."
+        index = self.classify(self.encode(x))
+        if index is None:
+            return None
+        return self.classAttribute.values[index]
+
+    def classify(self, values):
+        "Returns the index of the predicted class for an encoded instance."
+        util.raiseNotDefined()
+
+class DecisionTree:
+    """
+    A decision tree stored as parallel arrays with one entry per node:
+
+      attribute[n]     attribute tested at node n, -1 for leaves
+      threshold[n]     split point when that attribute is numeric
+      children[n][b]   node reached through branch b, -1 for empty branches
+      weights[n][b]    share of the training instances of node n that went
+                       through branch b
+      distribution[n]  class distribution predicted at node n
+
+    Numeric splits have two branches, values below threshold + tolerance
+    going to branch 0: J48 uses Weka's 1e-6 slack, so values at the
+    threshold go left, and RandomTree uses no slack.  Nominal splits have
+    one branch per label.
+
+    An instance whose tested value is missing (NaN, or not a label index of
+    the node) goes down every branch at once, and the distributions reached
+    are added up weighted by weights[n][b].  An empty branch, or a subtree
+    that predicts nothing, falls back to the distribution of the node.
+    """
+
+    def __init__(self, attribute, threshold, children, distribution, nominal, tolerance, weights=None):
+        self.attribute = attribute
+        self.threshold = threshold
+        self.children = children
+        self.distribution = distribution
+        self.nominal = nominal
+        self.tolerance = tolerance
+        self.weights = weights
+        # Plain lists are much faster than NumPy scalars when walking a
+        # single instance down the tree
+        self._attribute = attribute.tolist()
+        self._threshold = threshold.tolist()
+        self._children = children.tolist()
+        self._distribution = distribution.tolist()
+        self._empty = (distribution.sum(axis=1) == 0).tolist()
+        self._weights = None
+        if weights is not None:
+            self._weights = weights.tolist()
+
+    def branchesFor(self, nodes, v):
+        "Returns the branch that takes each value v at each node, -1 if v is missing there."
+        nominal = np.array(self.nominal + [False])[self.attribute[nodes]]
+        width = self.children.shape[1]
+        missing = np.isnan(v)
+        known = np.where(missing, 0.0, v)
+        numericBranch = known - self.threshold[nodes] >= self.tolerance
+        branch = np.where(nominal, known, numericBranch).astype(np.int64)
+        return np.where(missing | (branch < 0) | (branch >= width), -1, branch)
+
+    def leavesFor(self, matrix, roots):
+        """
+        Vectorised leafFor: returns an array with, for every row of matrix
+        (encoded instances) and every root, the node where it stops.
+        """
+        nodes = np.tile(np.asarray(roots), (len(matrix), 1))
+        active = self.attribute[nodes] >= 0
+        while active.any():
+            rows, trees = np.nonzero(active)
+            node = nodes[rows, trees]
+            branch = self.branchesFor(node, matrix[rows, self.attribute[node]])
+            child = np.where(branch >= 0, self.children[node, np.maximum(branch, 0)], -1)
+            moved = child >= 0
+            nodes[rows[moved], trees[moved]] = child[moved]
+            active[rows, trees] = moved
+            active[rows[moved], trees[moved]] = self.attribute[child[moved]] >= 0
+        return nodes
+
+    def missingAt(self, matrix, nodes):
+        "Tells, for every node of leavesFor's result, whether the row stopped at a missing value."
+        rows = np.arange(len(matrix))[:, None]
+        tested = self.attribute[nodes] >= 0
+        v = matrix[rows, np.where(tested, self.attribute[nodes], 0)]
+        return tested & (self.branchesFor(nodes, v) < 0)
+
+    def branchFor(self, node, v):
+        "Returns the branch that takes value v at node, -1 if v is missing there."
+        if v != v:
+            return -1
+        if self.nominal[self._attribute[node]]:
+            if 0 <= v < len(self._children[node]):
+                return int(v)
+            return -1
+        return int(v - self._threshold[node] >= self.tolerance)
+
+    def leafFor(self, values, node=0):
+        """
+        Returns the node where the instance stops: a leaf, a node whose
+        branch for the instance is empty, or a node testing a missing value.
+        """
+        # Same tests as branchFor, inlined since this is the hot loop
+        while True:
+            a = self._attribute[node]
+            if a < 0:
+                return node
+            v = values[a]
+            if v != v:
+                return node
+            if self.nominal[a]:
+                if not 0 <= v < len(self._children[node]):
+                    return node
+                branch = int(v)
+            else:
+                branch = int(v - self._threshold[node] >= self.tolerance)
+            child = self._children[node][branch]
+            if child < 0:
+                return node
+            node = child
+
+    def distributionFor(self, values, node=0):
+        """
+        Returns the class distribution predicted for an encoded instance by
+        the subtree of node, or None if it predicts nothing.
+        """
+        node = self.leafFor(values, node)
+        a = self._attribute[node]
+        if a >= 0 and self.branchFor(node, values[a]) < 0:
+            if self._weights is None:
+                raise Exception("The model was exported without branch weights and cannot "
+                                "classify missing values; export it again")
+            total = [0.0] * len(self._distribution[node])
+            for child, weight in zip(self._children[node], self._weights[node]):
+                if child < 0 or weight == 0:
+                    continue
+                distribution = self.distributionFor(values, child)
+                if distribution is not None:
+                    for c, p in enumerate(distribution):
+                        total[c] += weight * p
+            return total
+        if self._empty[node]:
+            return None
+        return self._distribution[node]
+
+class J48Predictor(NativePredictor):
+    """
+    A J48 tree exported with 'python exportModels.py j48 ...'.  Like
+    ClassifierTree.classifyInstance, the prediction is the first class whose
+    probability beats the previous best by more than WEKA_SMALL.
+    """
+
+    def __init__(self, fileName):
+        bundle = loadBundle(fileName)
+        NativePredictor.__init__(self, bundle['attributes'])
+        self.tree = DecisionTree(bundle['attribute'], bundle['threshold'], bundle['children'],
+                                 bundle['distribution'], self.nominal, WEKA_SMALL, bundle.get('weights'))
+
+    def classify(self, values):
+        distribution = self.tree.distributionFor(values) or []
+        best, index = -1.0, 0
+        for c, p in enumerate(distribution):
+            if p - best > WEKA_SMALL:
+                best, index = p, c
+        return index
+
+class RandomForestPredictor(NativePredictor):
+    """
+    A RandomForest exported with 'python exportModels.py rf ...'.  All of its
+    RandomTrees are flattened into one DecisionTree, roots[t] being the first
+    node of tree t, and every node stores its normalised class distribution.
+    As in Weka, the forest's distribution is the normalised sum of the tree
+    distributions and the prediction is its first maximum.  The weights of
+    the branches are RandomTree's m_Prop, which splits instances with a
+    missing value.
+    """
+
+    def __init__(self, fileName):
+        bundle = loadBundle(fileName)
+        NativePredictor.__init__(self, bundle['attributes'])
+        self.roots = bundle['roots']
+        self.forest = DecisionTree(bundle['attribute'], bundle['threshold'], bundle['children'],
+                                   bundle['distribution'], self.nominal, 0.0, bundle.get('weights'))
+        self._roots = self.roots.tolist()
+
+    def distributions(self, matrix):
+        "Returns the class distribution of every row of a matrix of encoded instances."
+        matrix = np.asarray(matrix, dtype=np.float64)
+        leaves = self.forest.leavesFor(matrix, self.roots)
+        distributions = self.forest.distribution[leaves]
+        # The few trees that stopped at a missing value split the row one by one
+        for row, tree in zip(*np.nonzero(self.forest.missingAt(matrix, leaves))):
+            distributions[row, tree] = self.forest.distributionFor(matrix[row].tolist(), leaves[row, tree])
+        sums = distributions.sum(axis=1)
+        totals = sums.sum(axis=1)[:, None]
+        return np.where(totals > 0, sums / np.where(totals > 0, totals, 1), 0.0)
+
+    def classifyBatch(self, matrix):
+        "Returns the predicted class index of every row, -1 where all the trees abstain."
+        distributions = self.distributions(matrix)
+        return np.where(distributions.sum(axis=1) > 0, distributions.argmax(axis=1), -1)
+
+    def predictBatch(self, rows):
+        "Returns the predicted label for each list of values in rows."
+        indices = self.classifyBatch([self.encode(x) for x in rows])
+        return [self.classAttribute.values[i] if i >= 0 else None for i in indices]
+
+    def classify(self, values):
+        # Walking the trees one by one is cheaper than the vectorised path
+        # for a single instance
+        sums = [0.0] * len(self.classAttribute.values)
+        for root in self._roots:
+            distribution = self.forest.distributionFor(values, root)
+            if distribution is not None:
+                for c, p in enumerate(distribution):
+                    sums[c] += p
+        if sum(sums) == 0:
+            return None
+        return sums.index(max(sums))
+
+class SMOPredictor(NativePredictor):
+    """
+    A linear-kernel SMO exported with 'python exportModels.py smo ...'.
+
+    Instances go through the same steps as inside Weka: missing values are
+    replaced by the training means and modes (ReplaceMissingValues), nominal
+    attributes are expanded as NominalToBinary does (one 0/1 column per label, or a
+    single column for two-label attributes), then every column is scaled by
+    multiply and shifted by add (the Normalize or Standardize filter).  Each
+    row of weights holds one pairwise machine: a positive output votes for
+    pairs[p][1] and any other for pairs[p][0], and the vote counts are the
+    class distribution.
+    """
+
+    def __init__(self, fileName):
+        bundle = loadBundle(fileName)
+        NativePredictor.__init__(self, bundle['attributes'])
+        self.weights = bundle['weights']
+        self.bias = bundle['bias']
+        self.pairs = bundle['pairs']
+        self.multiply = bundle['multiply']
+        self.add = bundle['add']
+        self.replacement = bundle.get('replacement')
+        self.columns = expandedColumns(self.attributes)
+
+    def expand(self, matrix):
+        "Applies NominalToBinary to a matrix of encoded instances."
+        expanded = np.zeros((len(matrix), self.weights.shape[1]))
+        for i, (column, width) in enumerate(self.columns):
+            if width == 1:
+                expanded[:, column] = matrix[:, i]
+            else:
+                labels = matrix[:, i].astype(np.int64)
+                known = (labels >= 0) & (labels < width)
+                expanded[np.nonzero(known)[0], column + labels[known]] = 1.0
+        return expanded
+
+    def distributions(self, matrix):
+        "Returns the class distribution of every row of a matrix of encoded instances."
+        matrix = np.asarray(matrix, dtype=np.float64).reshape(-1, len(self.columns))
+        missing = np.isnan(matrix)
+        if missing.any():
+            replacement = self.replacement
+            if replacement is None or np.isnan(replacement[:len(self.columns)][missing.any(axis=0)]).any():
+                raise Exception("The exported model has no replacement for missing values "
+                                "(export it again if it predates them)")
+            matrix = np.where(missing, replacement[:len(self.columns)], matrix)
+        filtered = self.expand(matrix) * self.multiply + self.add
+        outputs = filtered.dot(self.weights.T) - self.bias
+        winners = np.where(outputs > 0, self.pairs[:, 1], self.pairs[:, 0])
+        votes = np.zeros((len(matrix), len(self.classAttribute.values)))
+        for c in range(votes.shape[1]):
+            votes[:, c] = (winners == c).sum(axis=1)
+        return votes / np.maximum(votes.sum(axis=1), 1)[:, None]
+
+    def classifyBatch(self, matrix):
+        "Returns the predicted class index of every row."
+        return self.distributions(matrix).argmax(axis=1)
+
+    def predictBatch(self, rows):
+        "Returns the predicted label for each list of values in rows."
+        indices = self.classifyBatch([self.encode(x) for x in rows])
+        return [self.classAttribute.values[i] for i in indices]
+
+    def classify(self, values):
+        return int(self.classifyBatch([values])[0])
+
+def expandedColumns(attributes):
+    """
+    Returns, for every attribute but the class, the first column it takes
+    after NominalToBinary and how many columns it takes.
+    """
+    columns = []
+    column = 0
+    for attribute in attributes[:-1]:
+        width = 1
+        if attribute.isNominal() and len(attribute.values) > 2:
+            width = len(attribute.values)
+        columns.append((column, width))
+        column += width
+    return columns
+
+class KDTree:
+    """
+    A k-d tree over the rows of a point matrix.  Nodes are stored in parallel
+    arrays (split dimension, split value, children) and every leaf owns a
+    contiguous slice of the reordered points, so leaves are scanned with one
+    vectorised distance computation.
+    """
+
+    def __init__(self, points, leafSize=64):
+        self.leafSize = leafSize
+        self.dimension, self.value, self.left, self.right = [], [], [], []
+        self.start, self.end = [], []
+        self.order = np.arange(len(points))
+        self._build(points, 0, len(points))
+        self.points = points[self.order]
+
+    def _build(self, points, start, end):
+        node = len(self.dimension)
+        for field in (self.dimension, self.value, self.left, self.right):
+            field.append(-1)
+        self.start.append(start)
+        self.end.append(end)
+        if end - start <= self.leafSize:
+            return node
+        subset = points[self.order[start:end]]
+        spread = subset.max(axis=0) - subset.min(axis=0)
+        dimension = int(spread.argmax())
+        if spread[dimension] == 0:
+            return node
+        order = subset[:, dimension].argsort(kind='mergesort')
+        self.order[start:end] = self.order[start:end][order]
+        middle = start + (end - start) / 2
+        self.dimension[node] = dimension
+        self.value[node] = points[self.order[middle], dimension]
+        self.left[node] = self._build(points, start, middle)
+        self.right[node] = self._build(points, middle, end)
+        return node
+
+    def query(self, point, k=1, scale=None):
+        """
+        Returns the (squared distance, row) pairs of the k points nearest to
+        point, sorted by distance.  Like Weka, points tied with the k-th
+        nearest are all returned.  If given, scale multiplies every axis
+        before measuring distances.
+        """
+        if scale is None:
+            scale = np.ones(len(point))
+        best = []
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if len(best) >= k and bound > best[k - 1][0] * TIE_TOLERANCE:
+                continue
+            dimension = self.dimension[node]
+            if dimension < 0:
+                start, end = self.start[node], self.end[node]
+                distances = (((self.points[start:end] - point) * scale) ** 2).sum(axis=1)
+                rows = np.arange(start, end)
+                if len(best) >= k:
+                    # Only points that beat or tie the current k-th nearest matter
+                    close = distances <= best[k - 1][0] * TIE_TOLERANCE
+                    if not close.any():
+                        continue
+                    distances, rows = distances[close], rows[close]
+                best.extend(zip(distances.tolist(), self.order[rows].tolist()))
+                best.sort()
+                if len(best) > k:
+                    kth = best[k - 1][0] * TIE_TOLERANCE
+                    best = [b for b in best if b[0] <= kth]
+                continue
+            gap = (point[dimension] - self.value[node]) * scale[dimension]
+            near, far = self.left[node], self.right[node]
+            if gap >= 0:
+                near, far = far, near
+            stack.append((far, max(bound, gap * gap)))
+            stack.append((near, bound))
+        return best
+
+# Relative slack used to treat floating point distances as equal
+TIE_TOLERANCE = 1 + 1e-9
+
+# IBk's distance weighting options
+WEIGHT_NONE = 1
+WEIGHT_INVERSE = 2
+WEIGHT_SIMILARITY = 4
+
+class IBkPredictor(NativePredictor):
+    """
+    An IBk model exported with 'python exportModels.py ibk ...', evaluated
+    as Weka does with LinearNNSearch and a normalised EuclideanDistance:
+
+    - numeric differences are divided by the width of the attribute's range
+      and nominal ones are 0 or 1.  A missing value is as far as it can be:
+      1 if both values are missing or the attribute is nominal, otherwise
+      the normalised distance from the other value to the farthest end of
+      the range;
+    - every query first widens the ranges to include its values
+      (addInstanceInfo).  Weka keeps the widened ranges in the model, and
+      so does the predictor, so a query can depend on the ones before it,
+      just as with the model wekaI keeps loaded;
+    - the k neighbours stored in the model, plus any tied with the k-th,
+      vote with the model's distance weighting over a 1 / (training size)
+      prior, and the prediction is the first maximum.
+
+    Queries without missing values over training data without them go
+    through a k-d tree: widening a range only rescales its axis, which the
+    tree applies at query time.  The others scan every training instance.
+    """
+
+    def __init__(self, fileName):
+        bundle = loadBundle(fileName)
+        NativePredictor.__init__(self, bundle['attributes'])
+        self.k = int(bundle['k'])
+        self.weighting = int(bundle['weighting'])
+        self.data = bundle['train'][:, :-1]
+        self.classes = bundle['train'][:, -1].astype(np.int64).tolist()
+        self.instanceWeights = bundle['instanceWeights'].tolist()
+        self.minimum = bundle['minimum'][:-1].copy()
+        self.maximum = bundle['maximum'][:-1].copy()
+        self.isNominal = np.array(self.nominal, dtype=bool)
+        self.missing = np.isnan(self.data)
+        self.rescale()
+
+        self.tree = None
+        if len(self.data) and not self.missing.any():
+            # The tree stores numeric axes divided by their training range
+            self.base = np.where(self.scale > 0, self.scale, 1.0)
+            self.tree = KDTree(self.embed(self.data))
+
+    def rescale(self):
+        "Updates what depends on the ranges: the scale of each attribute and the normalised training data."
+        width = self.maximum - self.minimum
+        usable = np.isfinite(width) & (width > 0) & ~self.isNominal
+        self.scale = np.where(usable, 1.0 / np.where(usable, width, 1), 0.0)
+        self.offset = np.where(usable, self.minimum, 0.0)
+        self.normalised = (self.data - self.offset) * self.scale
+
+    def addInstanceInfo(self, query):
+        "Widens the numeric ranges to include the values of query, as Weka does before every query."
+        known = ~self.isNominal & ~np.isnan(query)
+        lower = known & (np.where(known, query, 0.0) < self.minimum)
+        upper = known & (np.where(known, query, 0.0) > self.maximum)
+        if lower.any() or upper.any():
+            self.minimum = np.where(lower, query, self.minimum)
+            self.maximum = np.where(upper, query, self.maximum)
+            self.rescale()
+
+    def squaredDistances(self, query):
+        "Returns Weka's squared distance from query to every training instance."
+        missing = np.isnan(query)
+        a = self.normalised
+        q = (query - self.offset) * self.scale
+        # With one value missing, the farthest end of the range from the other
+        diff = np.where(self.missing, np.maximum(q, 1 - q), a - q)
+        diff = np.where(missing, np.maximum(a, 1 - a), diff)
+        diff = np.where(self.missing & missing, 1.0, diff)
+        diff = np.where(self.isNominal, (self.data != query) | self.missing | missing, diff)
+        return (diff ** 2).sum(axis=1)
+
+    def embed(self, data):
+        "Maps encoded instances (one per row) to the space searched by the tree."
+        columns = []
+        for i, attribute in enumerate(self.attributes[:-1]):
+            if attribute.isNominal():
+                labels = np.arange(len(attribute.values))
+                columns.append((data[:, i:i + 1] == labels) * np.sqrt(0.5))
+            else:
+                columns.append((data[:, i] * self.base[i])[:, None])
+        return np.hstack(columns)
+
+    def axisScale(self):
+        "Returns the factors that turn distances between embedded points into Weka's with the current ranges."
+        axes = []
+        for i, attribute in enumerate(self.attributes[:-1]):
+            if attribute.isNominal():
+                axes.extend([1.0] * len(attribute.values))
+            else:
+                axes.append(self.scale[i] / self.base[i])
+        return np.array(axes)
+
+    def neighbours(self, values):
+        "Returns the (squared distance, row) pairs of the nearest training instances."
+        query = np.array(values[:len(self.nominal)], dtype=np.float64)
+        self.addInstanceInfo(query)
+        if self.tree is not None and not np.isnan(query).any():
+            return self.tree.query(self.embed(query[None, :])[0], self.k, self.axisScale())
+        distances = self.squaredDistances(query)
+        rows = np.arange(len(distances))
+        if len(distances) > self.k:
+            kth = np.partition(distances, self.k - 1)[self.k - 1]
+            rows = rows[distances <= kth * TIE_TOLERANCE]
+        return zip(distances[rows].tolist(), rows.tolist())
+
+    def classify(self, values):
+        distribution = [1.0 / max(1, len(self.classes))] * len(self.classAttribute.values)
+        for squared, row in self.neighbours(values):
+            # IBk.makeDistribution: distances averaged over the attributes
+            distance = np.sqrt(squared / len(self.nominal))
+            weight = 1.0
+            if self.weighting == WEIGHT_INVERSE:
+                weight = 1.0 / (distance + 0.001)
+            elif self.weighting == WEIGHT_SIMILARITY:
+                weight = 1.0 - distance
+            distribution[self.classes[row]] += weight * self.instanceWeights[row]
+        return distribution.index(max(distribution))
+
+# Backends that BasicAgentAA can use instead of Weka.predict.  Each one is
+# built from the agent's model and arffName arguments.
+BACKENDS = {
+    'j48': lambda model, arffName: J48Predictor(model),
+    'ibk': lambda model, arffName: IBkPredictor(model),
+    'rf': lambda model, arffName: RandomForestPredictor(model),
+    'smo': lambda model, arffName: SMOPredictor(model),
+}
+
+def loadPredictor(backend, model, arffName):
+    if backend not in BACKENDS:
+        raise Exception('Unknown model backend: ' + backend)
+    return BACKENDS[backend](model, arffName)
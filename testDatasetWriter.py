@@ -0,0 +1,62 @@
+# testDatasetWriter.py
+# --------------------
+# Checks that DatasetWriter appends to existing ARFF logs without mixing up
+# their rows.
+#
+# USAGE:   python testDatasetWriter.py
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import datasetWriter
+
+HEADER = "@RELATION pacman\n\n@ATTRIBUTE a NUMERIC\n@ATTRIBUTE b {x,y}\n\n\n@DATA\n"
+
+class DatasetWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirName = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.dirName, "log.arff")
+
+    def tearDown(self):
+        shutil.rmtree(self.dirName)
+
+    def read(self):
+        f = open(self.fileName)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def append(self, *rows):
+        writer = datasetWriter.DatasetWriter(self.fileName, HEADER)
+        for row in rows:
+            writer.writeLine(row)
+        writer.close()
+
+    def testNewFileGetsHeader(self):
+        self.append("1, x")
+        self.assertEqual(self.read(), HEADER + "1, x\n")
+
+    def testAppendAfterNewline(self):
+        self.append("1, x")
+        self.append("2, y")
+        self.assertEqual(self.read(), HEADER + "1, x\n2, y\n")
+
+    def testAppendWithoutTrailingNewline(self):
+        f = open(self.fileName, "w")
+        f.write(HEADER + "1, x\n2, y")
+        f.close()
+        self.append("3, x")
+        self.assertEqual(self.read(), HEADER + "1, x\n2, y\n3, x\n")
+
+    def testDifferentHeader(self):
+        self.append("1, x")
+        writer = datasetWriter.DatasetWriter(self.fileName, HEADER.replace("{x,y}", "{x,z}"))
+        writer.writeLine("2, z")
+        self.assertRaises(Exception, writer.close)
+
+if __name__ == '__main__':
+    unittest.main()
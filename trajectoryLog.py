@@ -0,0 +1,182 @@
+# trajectoryLog.py
+# ----------------
+# Columnar alternative to the ARFF training logs.  A log is a directory with
+#
+#   schema.json        relation name and attributes ([name, values] pairs,
+#                      values being null for numeric attributes)
+#   <attribute>.bin    one raw array per attribute: float64 for numeric
+#                      attributes (NaN when missing) and int8 label indices
+#                      for nominal ones (-1 when missing)
+#
+# Rows are appended to every column file at once, so a log can be extended
+# by later runs, and the loader memory-maps the columns instead of parsing
+# text.  An exporter writes the log back as ARFF for Weka.
+#
+# USAGE:   python trajectoryLog.py <log directory> <output.arff>
+# EXAMPLE: python busters.py -p BustersKeyboardAgent --dataFormat columns -d keyboard_log
+#          python trajectoryLog.py keyboard_log training_keyboard.arff
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from arffData import ArffAttribute
+
+NUMERIC_TYPE = np.float64
+NOMINAL_TYPE = np.int8
+BUFFER_ROWS = 4096
+
+def columnFile(dirName, attribute):
+    return os.path.join(dirName, attribute.name + ".bin")
+
+def columnType(attribute):
+    if attribute.isNominal():
+        return NOMINAL_TYPE
+    return NUMERIC_TYPE
+
+def readSchema(dirName):
+    "Returns (relation, attributes) of the log in dirName."
+    f = open(os.path.join(dirName, "schema.json"))
+    try:
+        schema = json.load(f)
+    finally:
+        f.close()
+    attributes = [ArffAttribute(str(name), values and [str(v) for v in values])
+                  for name, values in schema["attributes"]]
+    return str(schema["relation"]), attributes
+
+def writeSchema(dirName, relation, attributes):
+    f = open(os.path.join(dirName, "schema.json"), "w")
+    try:
+        json.dump({"relation": relation,
+                   "attributes": [[a.name, a.values] for a in attributes]}, f)
+    finally:
+        f.close()
+
+def checkTarget(dirName):
+    "Raises if dirName cannot hold a log because a regular file is in the way."
+    if os.path.exists(dirName) and not os.path.isdir(dirName):
+        raise Exception("%s is a file, a columnar log must be a directory" % dirName)
+
+class TrajectoryWriter:
+    """
+    Appends rows to a columnar log.  It has the interface of
+    datasetWriter.DatasetWriter, so Game.run can write through either.
+    Rows are kept in memory until bufferRows of them are waiting or flush()
+    is called.
+    """
+
+    # Every row needs one value per attribute, not a formatted line
+    takesLines = False
+
+    def __init__(self, dirName, attributes, relation="pacman", bufferRows=BUFFER_ROWS):
+        self.dirName = dirName
+        self.attributes = list(attributes)
+        self.relation = relation
+        self.bufferRows = bufferRows
+        self.codes = [a.isNominal() and dict([(v, i) for i, v in enumerate(a.values)])
+                      for a in self.attributes]
+        self.buffer = []
+        self.files = None
+
+    def open(self):
+        if self.files is not None:
+            return
+        checkTarget(self.dirName)
+        if not os.path.isdir(self.dirName):
+            os.makedirs(self.dirName)
+        if os.path.exists(os.path.join(self.dirName, "schema.json")):
+            relation, attributes = readSchema(self.dirName)
+            if [str(a) for a in attributes] != [str(a) for a in self.attributes]:
+                raise Exception("The log in %s has different attributes" % self.dirName)
+        else:
+            writeSchema(self.dirName, self.relation, self.attributes)
+        self.files = [open(columnFile(self.dirName, a), "ab") for a in self.attributes]
+
+    def writeRow(self, values):
+        if len(values) != len(self.attributes):
+            raise Exception("Expected %d values, got %d" % (len(self.attributes), len(values)))
+        self.buffer.append(list(values))
+        if len(self.buffer) >= self.bufferRows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.open()
+        for i, attribute in enumerate(self.attributes):
+            column = [row[i] for row in self.buffer]
+            codes = self.codes[i]
+            if codes:
+                column = [codes.get(v, -1) for v in column]
+            else:
+                column = [np.nan if v is None else v for v in column]
+            np.array(column, dtype=columnType(attribute)).tofile(self.files[i])
+            self.files[i].flush()
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self.files is not None:
+            for f in self.files:
+                f.close()
+            self.files = None
+
+def loadTrajectory(dirName):
+    """
+    Returns (attributes, columns) for the log in dirName, columns being one
+    read-only memory-mapped array per attribute.  If a run was interrupted
+    in the middle of a flush, the rows missing from some column are dropped.
+    """
+    relation, attributes = readSchema(dirName)
+    itemSizes = [np.dtype(columnType(a)).itemsize for a in attributes]
+    numRows = min([os.path.getsize(columnFile(dirName, a)) // size
+                   for a, size in zip(attributes, itemSizes)])
+    columns = []
+    for attribute in attributes:
+        if numRows == 0:
+            columns.append(np.zeros(0, dtype=columnType(attribute)))
+        else:
+            columns.append(np.memmap(columnFile(dirName, attribute), dtype=columnType(attribute),
+                                     mode="r", shape=(numRows,)))
+    return attributes, columns
+
+def formatColumn(attribute, column):
+    "ARFF text of every value in column."
+    if attribute.isNominal():
+        labels = np.array(attribute.values + ["?"], dtype=object)
+        return labels[np.where(column < 0, len(attribute.values), column)]
+    text = []
+    for value in column.tolist():
+        if value != value:
+            text.append("?")
+        elif value == int(value):
+            text.append(str(int(value)))
+        else:
+            text.append(repr(value))
+    return text
+
+def exportArff(dirName, arffName, chunkRows=65536):
+    "Writes the log in dirName as an ARFF file."
+    relation = readSchema(dirName)[0]
+    attributes, columns = loadTrajectory(dirName)
+    out = open(arffName, "w")
+    try:
+        out.write("@RELATION %s\n\n" % relation)
+        for attribute in attributes:
+            out.write(str(attribute) + "\n")
+        out.write("\n\n@DATA\n")
+        numRows = len(columns[0]) if columns else 0
+        for start in range(0, numRows, chunkRows):
+            text = [formatColumn(a, c[start:start + chunkRows]) for a, c in zip(attributes, columns)]
+            out.write("".join([", ".join(row) + "\n" for row in zip(*text)]))
+    finally:
+        out.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print 'USAGE: python trajectoryLog.py <log directory> <output.arff>'
+        sys.exit(1)
+    exportArff(sys.argv[1], sys.argv[2])
@@ -1,24 +1,103 @@
-import weka.core.jvm as jvm
-import weka.core.serialization as serialization
-from weka.core.converters import Loader
-import weka.core.dataset as ds
-from weka.core.dataset import Instances, Attribute, Instance
-from weka.classifiers import Classifier
+import atexit
+import os
+from collections import OrderedDict
 
 # Para poder utilizar esta clase ejecutar en un terminal los comandos:
 # pip install javabridge
 # pip install python-weka-wrapper==0.3.0
 
+# Los modulos de weka (y javabridge) se importan la primera vez que se
+# arranca la maquina virtual, para que los agentes que no predicen no
+# dependan de ellos ni paguen su carga
+javabridge = jvm = serialization = Loader = Instances = Instance = Classifier = None
+
+def importWeka():
+	global javabridge, jvm, serialization, Loader, Instances, Instance, Classifier
+	if jvm is not None:
+		return
+	import javabridge
+	import weka.core.jvm as jvm
+	import weka.core.serialization as serialization
+	from weka.core.converters import Loader
+	from weka.core.dataset import Instances, Instance
+	from weka.classifiers import Classifier
+
+# Una unica maquina virtual para todo el proceso. Se arranca con el primer
+# usuario y se cuentan las referencias, pero no se para al llegar a cero:
+# javabridge no puede volver a arrancarla en el mismo proceso, asi que una
+# partida posterior no podria predecir. Se para al salir del interprete.
+jvmUsers = 0
+jvmStarted = False
+
+def acquireJVM():
+	global jvmUsers, jvmStarted
+	if not jvmStarted:
+		importWeka()
+		jvm.start()
+		jvmStarted = True
+		atexit.register(shutdownJVM)
+	jvmUsers += 1
+
+def releaseJVM():
+	global jvmUsers
+	jvmUsers = max(0, jvmUsers - 1)
+
+def shutdownJVM():
+	global jvmStarted
+	if jvmStarted:
+		jvm.stop()
+		jvmStarted = False
+
+# Numero maximo de modelos (y de cabeceras arff) que se mantienen cargados
+CACHE_SIZE = 8
+
+# Caches compartidas por todas las instancias de Weka. Cada entrada guarda la
+# fecha de modificacion del fichero junto al objeto cargado, y el orden del
+# OrderedDict indica el uso mas reciente (el primero es el que se descarta).
+modelCache = OrderedDict()
+headerCache = OrderedDict()
+
+def loadCached(cache, fileName, load):
+	key = os.path.abspath(fileName)
+	mtime = os.path.getmtime(key)
+	entry = cache.pop(key, None)
+	if entry is None or entry[0] != mtime:
+		entry = (mtime, load(key))
+	cache[key] = entry
+	while len(cache) > CACHE_SIZE:
+		cache.popitem(last=False)
+	return entry[1]
+
+def loadHeader(arffName):
+	loader = Loader(classname="weka.core.converters.ArffLoader")
+	data = loader.load_file(arffName)
+	# Se asume que la clase es el ultimo atributo
+	data.class_is_last()
+	return data
+
+def loadModel(modelName):
+	objects = serialization.read_all(modelName)
+	return Classifier(jobject=objects[0])
+
 class Weka:
 
-	# Arranca la maquina virtual de java
+	def __init__(self):
+		self.started = False
+
+	# Arranca la maquina virtual de java (si no lo estaba ya). No hace falta
+	# llamarlo antes de predecir: predict lo hace la primera vez
 	#
 	def start_jvm(self):
-		jvm.start()
+		if not self.started:
+			acquireJVM()
+			self.started = True
 
-	# Para la maquina virtual de java
+	# Deja de usar la maquina virtual de java. Se para de verdad al terminar
+	# el proceso, cuando ya no la usa nadie
 	def stop_jvm(self):
-		jvm.stop()
+		if self.started:
+			releaseJVM()
+			self.started = False
 
 	# Predice el valor de la instancia pasada como parametro
 	# @param modelName: Nombre del fichero que contiene el modelo generado en weka
@@ -26,17 +105,17 @@ class Weka:
 	# @param arffName: El nombre del fichero arff que se ha utilizado para generar el modelo en Weka
 	# @return pred: La clase que predice
 	#
+	# El modelo y el arff solo se leen de disco la primera vez (o cuando cambian),
+	# las siguientes llamadas los obtienen de la cache
+	#
 	def predict(self, modelName, x, arffName, debug=False):
-		# Carga el arrf para conocer la estructura de las instancias
-		loader = Loader(classname="weka.core.converters.ArffLoader")
-		data = loader.load_file(arffName)
+		self.start_jvm()
 
-		# Se asume que la clase es el ultimo atributo
-		data.class_is_last()
+		# Carga el arrf para conocer la estructura de las instancias
+		data = loadCached(headerCache, arffName, loadHeader)
 
 		# Carga del modelo generado en Weka
-		objects = serialization.read_all(modelName)
-		cls = Classifier(jobject=objects[0])
+		cls = loadCached(modelCache, modelName, loadModel)
 		if(debug): 
 			print("Loaded model...")
 			print(cls)
@@ -44,7 +123,9 @@ class Weka:
 		# Se crea la instancia correspondiente a la entrada y se clasifica
 		if(debug): print("Input", x)
 
-		# Anyade un valor tonto para la clase de la instancia
+		# Anyade un valor tonto para la clase de la instancia (sobre una copia,
+		# para no modificar la lista del llamante)
+		x = list(x)
 		if data.class_attribute.is_nominal:
 			x.append('a')
 		else:
@@ -66,6 +147,68 @@ class Weka:
 
 		return pred
 
+	# Predice de una sola vez todas las instancias de rows
+	# @param modelName: Nombre del fichero que contiene el modelo generado en weka
+	# @param rows: Lista de instancias (listas de valores sin la clase)
+	# @param arffName: El nombre del fichero arff que se ha utilizado para generar el modelo en Weka
+	# @param distribution: Si es True devuelve la distribucion de probabilidad de cada instancia
+	# @return preds: Lista con la clase (o la distribucion) que predice para cada instancia
+	#
+	# Las filas se escriben como texto arff y Java construye con ellas un unico
+	# Instances, asi que los datos cruzan javabridge en una sola llamada en vez de
+	# varias por instancia
+	#
+	def predict_batch(self, modelName, rows, arffName, distribution=False, debug=False):
+		self.start_jvm()
+
+		data = loadCached(headerCache, arffName, loadHeader)
+		cls = loadCached(modelCache, modelName, loadModel)
+
+		# Cabecera del arff sin datos seguida de una linea por fila, con la clase desconocida
+		lines = [str(Instances.template_instances(data))]
+		for x in rows:
+			lines.append(",".join([formatValue(v) for v in x] + ["?"]))
+		reader = javabridge.make_instance("java/io/StringReader", "(Ljava/lang/String;)V", "\n".join(lines))
+		batch = Instances(javabridge.make_instance("weka/core/Instances", "(Ljava/io/Reader;)V", reader))
+		batch.class_is_last()
+		if(debug): print("Batch", batch.num_instances)
+
+		# Los clasificadores que implementan BatchPredictor clasifican todo el
+		# conjunto dentro de la JVM; el resto se recorre instancia a instancia
+		if javabridge.is_instance_of(cls.jobject, "weka/core/BatchPredictor"):
+			dists = javabridge.call(cls.jobject, "distributionsForInstances", "(Lweka/core/Instances;)[[D", batch.jobject)
+			env = javabridge.get_env()
+			dists = [env.get_double_array_elements(d) for d in env.get_object_array_elements(dists)]
+		else:
+			dists = [cls.distribution_for_instance(batch.get_instance(i)) for i in range(batch.num_instances)]
+
+		if distribution:
+			return [list(d) for d in dists]
+
+		preds = []
+		for d in dists:
+			if not data.class_attribute.is_nominal:
+				preds.append(d[0])
+			elif sum(d) == 0:
+				preds.append(None)
+			else:
+				# Como Weka, ante empate se queda con el primer valor maximo
+				best = max(range(len(d)), key=lambda i: (d[i], -i))
+				preds.append(data.class_attribute.value(best))
+		if(debug): print("Predictions", preds)
+
+		return preds
+
+# Convierte un valor de una fila al formato de los datos de un arff
+def formatValue(value):
+	if value is None:
+		return "?"
+	if isinstance(value, basestring):
+		return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+	if isinstance(value, float):
+		return repr(value)
+	return str(value)
+
 ################################# DEBUG ##############################################
 #weka = Weka()
 #weka.start_jvm()